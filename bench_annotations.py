@@ -0,0 +1,73 @@
+import timeit
+import numpy as np
+import pandas as pd
+from plots import col_list, bargroupgap, column_values, bar_label_annotations, make_barplot
+
+# Compares the vectorized bar label builder with the former per-row df.iloc loop
+# (kept below as reference) at increasing numbers of quantile bins.
+
+N_BINS = [10, 100, 1000]
+
+
+def make_df(n_bins, seed=0):
+    rng = np.random.default_rng(seed)
+    payment = np.sort(rng.uniform(100, 2000, n_bins))
+    revenue = np.full(n_bins, payment.mean())
+    return pd.DataFrame({'income decile': np.arange(1, n_bins + 1),
+                         'carbon payment': payment,
+                         'carbon revenue': revenue,
+                         'net gain': revenue - payment})
+
+def loop_annotations(df, orientation='h', payment_negative=False):
+    idx = df['income decile']
+    annotations = []
+    space = 0
+    for col_i, col in enumerate(col_list):
+        for i in range(0, len(idx)):
+            if orientation == 'h':
+                if col == 'carbon payment' and payment_negative:
+                    x_loc = - df.iloc[i, :][col]
+                else:
+                    x_loc = df.iloc[i][col]
+
+                y_loc = df.iloc[i, :]['income decile'] + (col_i - 1) * (bargroupgap + 0.125)
+                value = x_loc
+                x_loc = 0.5 * x_loc
+            else:
+                if col == 'carbon payment' and payment_negative:
+                    y_loc = - df.iloc[i, :][col]
+                else:
+                    y_loc = df.iloc[i][col]
+
+                x_loc = df.iloc[i, :]['income decile'] + (col_i - 1) * (bargroupgap + 0.125)
+                value = y_loc
+                y_loc = 0.5* y_loc
+            annotations.append(dict(xref='x', yref='y',
+                                    x=space + x_loc, y=y_loc,
+                                    text= f'{value:.0f}' ,
+                                    font=dict(family='Arial', size=14,
+                                              color='rgb(240, 240, 250)'),
+                                    showarrow=False))
+    return annotations
+
+def vectorized_annotations(df, orientation='h', payment_negative=False):
+    values = column_values(df, col_list, payment_negative)
+    offsets = (np.arange(len(col_list)) - 1) * (bargroupgap + 0.125)
+    return bar_label_annotations(df['income decile'].to_numpy(), values, offsets, orientation)
+
+def best_of(func, repeat=3):
+    number = 1
+    while min(timeit.repeat(func, number=number, repeat=1)) < 0.2 and number < 1000:
+        number *= 10
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+if __name__ == '__main__':
+    print(f"{'bins':>6} {'loop (ms)':>12} {'vectorized (ms)':>16} {'speedup':>8} {'barplot (ms)':>13}")
+    for n_bins in N_BINS:
+        df = make_df(n_bins)
+        assert loop_annotations(df, 'h', True) == vectorized_annotations(df, 'h', True)
+        t_loop = best_of(lambda: loop_annotations(df, 'h', True), repeat=1 if n_bins >= 1000 else 3)
+        t_vec = best_of(lambda: vectorized_annotations(df, 'h', True))
+        t_fig = best_of(lambda: make_barplot(df, {'price_unit': 'Euro'}, 'h', True), repeat=1)
+        print(f"{n_bins:>6} {1e3 * t_loop:>12.2f} {1e3 * t_vec:>16.3f} {t_loop / t_vec:>7.0f}x {1e3 * t_fig:>13.1f}")
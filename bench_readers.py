@@ -0,0 +1,120 @@
+import argparse
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from readers import read_long, read_wide
+
+# Benchmarks the chunked raw-file readers (readers.py) against the whole-file
+# reads they replaced in process_rawdata.py, on synthetic raw files:
+#   python bench_readers.py --sizes-mb 64 256 2048
+# Every read runs once in a fresh process, which reports its time and peak RSS.
+# The whole-file reads are skipped above --legacy-max-mb, they need many times
+# the file size in memory.
+
+SIZES_MB = [64, 256, 2048]
+LEGACY_MAX_MB = 256
+BLOCK_ROWS = 100_000
+long_names = ['bar number', 'price', 'income decile', 'payment/revenue']
+long_categories = ['carbon payment', 'carbon revenue', 'net gain']
+# rows of the wide file cycle over this many categories, as regions or years would
+WIDE_CATEGORIES = 1000
+WIDE_BINS = 10
+
+
+def write_long(path, size_bytes, seed=0):
+    # 'Bar<n>, <value>, <bin>, <category>' with 3 categories per bin, like the Belgium file
+    rng = np.random.default_rng(seed)
+    row = 0
+    with open(path, 'w') as f:
+        while f.tell() < size_bytes:
+            rows = np.arange(row, row + BLOCK_ROWS)
+            values = pd.Series(rng.uniform(0, 500, BLOCK_ROWS)).astype(str)
+            lines = ('Bar' + pd.Series(rows // 3).astype(str) + ', ' + values + ', '
+                     + pd.Series(rows // 3).astype(str) + ', '
+                     + pd.Series(np.array(long_categories)[rows % 3]))
+            f.write('\n'.join(lines) + '\n')
+            row += BLOCK_ROWS
+
+def write_wide(path, size_bytes, seed=0):
+    # categories as rows, deciles as columns, decimal commas, like the UK file
+    rng = np.random.default_rng(seed)
+    header = ',,,,' + ','.join(f'Income Decile {i}' for i in range(1, WIDE_BINS + 1)) + ',Total\n'
+    row = 0
+    with open(path, 'w') as f:
+        f.write(header)
+        while f.tell() < size_bytes:
+            rows = np.arange(row, row + BLOCK_ROWS // 10)
+            lines = 'Category ' + pd.Series(rows % WIDE_CATEGORIES).astype(str) + ',,,'
+            for _ in range(WIDE_BINS):
+                values = pd.Series(rng.uniform(0, 1000, len(rows)).round(2)).astype(str).str.replace('.', ',',
+                                                                                                     regex=False)
+                lines = lines + ',"' + values + '"'
+            f.write('\n'.join(lines + ',') + '\n')
+            row += len(rows)
+
+def legacy_long(path):
+    # process_rawdata.parse_belgium before readers.py
+    df = pd.read_csv(path, sep=', ', header=None, engine='python')
+    df.columns = long_names
+    return df.pivot(values='price', index='income decile', columns='payment/revenue')
+
+def legacy_wide(path):
+    # process_rawdata.parse_uk before readers.py
+    df = pd.read_csv(path, decimal=',')
+    unnamed_cols = [col for col in df.columns if 'Unnamed' in col]
+    df = df.drop(columns=unnamed_cols[1:])
+    df = df.rename(columns={unnamed_cols[0]: 'category'})
+    df = df.set_index('category').T.reset_index()
+    df = df[df['index'] != 'Total']
+    df['income decile'] = df['index'].str.extract(r'(\d+)').astype(int)
+    return df.set_index('income decile').drop(columns=['index'])
+
+readers = {'long': {'whole file (python engine)': legacy_long,
+                    'chunked (C engine)': lambda path: read_long(path, long_names, 'price', 'income decile',
+                                                                 'payment/revenue')},
+           'wide': {'whole file (transpose)': legacy_wide,
+                    'chunked (C engine)': read_wide}}
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def timed_read(file_format, name, path):
+    # runs in a fresh process: (seconds, peak RSS)
+    start = time.perf_counter()
+    readers[file_format][name](path)
+    return time.perf_counter() - start, peak_rss_bytes()
+
+def run_isolated(file_format, name, path):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(timed_read, file_format, name, path).result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the raw-file readers on synthetic files')
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=SIZES_MB)
+    parser.add_argument('--legacy-max-mb', type=int, default=LEGACY_MAX_MB)
+    parser.add_argument('--formats', nargs='+', default=list(readers), choices=list(readers))
+    parser.add_argument('--dir', default=None, help='directory for the synthetic files (default: a temporary one)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        print(f"{'format':<6} {'file (MB)':>9}  {'reader':<28} {'time (s)':>9} {'MB/s':>7} {'peak RSS (MB)':>14}")
+        for file_format in args.formats:
+            for size_mb in args.sizes_mb:
+                path = pathlib.Path(tmp) / f'{file_format}-{size_mb}.csv'
+                (write_long if file_format == 'long' else write_wide)(path, size_mb * 2**20)
+                file_mb = path.stat().st_size / 2**20
+                for name in readers[file_format]:
+                    if name != 'chunked (C engine)' and size_mb > args.legacy_max_mb:
+                        print(f"{file_format:<6} {file_mb:>9.0f}  {name:<28} {'skipped':>9}")
+                        continue
+                    seconds, peak = run_isolated(file_format, name, path)
+                    print(f"{file_format:<6} {file_mb:>9.0f}  {name:<28} {seconds:>9.2f} "
+                          f"{file_mb / seconds:>7.1f} {peak / 2**20:>14.0f}")
+                path.unlink()
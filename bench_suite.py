@@ -0,0 +1,188 @@
+import argparse
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import pandas as pd
+from datastore import DatasetRegistry, write_store
+from figures import change_to_quantiles
+from plots import plot_builders
+from process_rawdata import test_data
+
+# Benchmarks the figure pipeline on synthetic datasets, step by step:
+#   python bench_suite.py --out bench_base.json              # on the base commit
+#   python bench_suite.py --out bench_new.json --compare bench_base.json --threshold 0.2
+# Each result has the median time per call over ROUNDS rounds, each round
+# calling the step for at least MIN_ROUND_SECONDS, the spread of the rounds
+# (interquartile range relative to the median) and the tracemalloc peak of one
+# run. --compare exits with status 1 when a time or a memory peak regressed by
+# more than the threshold (relative) and by more than the noise floor
+# (absolute). Times are only gated from GATE_MIN_SECONDS, with the threshold
+# raised by the spreads of both runs: on a shared machine ms-scale steps vary
+# by 30% and more between runs of the same code. The --quick grid only has
+# such steps, its times are informational.
+
+COUNTRY_COUNTS = [1, 10, 100, 500]
+BIN_COUNTS = [5, 10, 100, 1000]
+QUICK_COUNTRY_COUNTS = [1, 10]
+QUICK_BIN_COUNTS = [10, 100]
+THRESHOLD = 0.2
+ROUNDS = 7
+MIN_ROUND_SECONDS = 0.2
+# differences below these are measurement noise, whatever the ratio
+MIN_SECONDS = 2e-3
+GATE_MIN_SECONDS = 0.05
+MIN_BYTES = 64 * 1024
+
+metadata = {'text': 'Synthetic benchmark dataset', 'price': '60', 'time_unit': 'year',
+            'price_unit': 'Euro', 'origin': 'bench_suite.py'}
+
+
+def synthetic_data(n_bins, seed=0):
+    # same schema as the processed datasets: net gains add up to zero
+    rng = np.random.default_rng(seed)
+    payment = np.sort(rng.uniform(100, 2000, n_bins))
+    revenue = np.full(n_bins, payment.mean())
+    df = pd.DataFrame({'carbon payment': payment,
+                       'carbon revenue': revenue,
+                       'net gain': revenue - payment,
+                       'calc_tCO2': payment / float(metadata['price'])},
+                      index=pd.RangeIndex(1, n_bins + 1, name='income decile'))
+    return df
+
+def write_datasets(data_path, n_countries, n_bins):
+    # country names for the synthetic datasets, written to the Arrow store under data_path
+    names = [f'country{i:03d}' for i in range(n_countries)]
+    for i, name in enumerate(names):
+        df = synthetic_data(n_bins, seed=i)
+        if i == 0:
+            test_data(df)
+        write_store(df, name, metadata, data_path / 'store')
+    return names
+
+def median_time(func, rounds=ROUNDS, min_round_seconds=MIN_ROUND_SECONDS):
+    # (seconds per call, spread): the median over rounds of as many calls as fill min_round_seconds
+    timer = timeit.Timer(func)
+    number, seconds = 1, timer.timeit(1)
+    while seconds < min_round_seconds:
+        number = max(2 * number, int(number * min_round_seconds / max(seconds, 1e-9)) + 1)
+        seconds = timer.timeit(number)
+    times = [seconds / number] + [timer.timeit(number) / number for _ in range(rounds - 1)]
+    low, median, high = np.percentile(times, [25, 50, 75])
+    return float(median), float((high - low) / median)
+
+def measure(func, rounds=ROUNDS):
+    # (median seconds, spread, peak bytes allocated during one run); the warm-up run
+    # keeps one-off costs like plotly's lazy validator imports out of the peak
+    func()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return median_time(func, rounds) + (peak,)
+
+def run_benchmarks(country_counts=COUNTRY_COUNTS, bin_counts=BIN_COUNTS):
+    results = []
+
+    def record(benchmark, n_countries, n_bins, func, rounds=ROUNDS):
+        seconds, spread, peak = measure(func, rounds)
+        results.append(dict(benchmark=benchmark, countries=n_countries, bins=n_bins,
+                            seconds=seconds, spread=spread, peak_bytes=peak))
+        print(f"{benchmark:>26} {n_countries:>9} {n_bins:>6} {1e3 * seconds:>12.3f} {spread:>7.0%} "
+              f"{peak / 1e6:>10.2f}")
+
+    print(f"{'benchmark':>26} {'countries':>9} {'bins':>6} {'time (ms)':>12} {'spread':>7} {'peak (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_bins in bin_counts:
+            data_path = pathlib.Path(tmp) / f'bins{n_bins}'
+            names = write_datasets(data_path, max(country_counts), n_bins)
+
+            def new_registry():
+                return DatasetRegistry(data_path, data_path, data_path / 'store')
+
+            for n_countries in country_counts:
+                selected = names[:n_countries]
+                record('load_data (cold)', n_countries, n_bins,
+                       lambda: [new_registry().load_data(name) for name in selected])
+                registry = new_registry()
+                for name in selected:
+                    registry.load_data(name)
+                record('load_data (warm)', n_countries, n_bins,
+                       lambda: [registry.load_data(name) for name in selected])
+
+            # the per-figure steps do not depend on the number of countries
+            registry = new_registry()
+            df, meta_data = registry.load_data(names[0]), registry.load_metadata(names[0])
+            record('change_to_quintiles', 1, n_bins, lambda: change_to_quantiles(df, 5))
+            rounds = 3 if n_bins >= 1000 else ROUNDS
+            for plot_type, make_plot in plot_builders.items():
+                record(f'build {plot_type}', 1, n_bins,
+                       lambda: make_plot(df, meta_data, orientation='h', country=names[0]), rounds)
+                fig = make_plot(df, meta_data, orientation='h', country=names[0])
+                record(f'to_json {plot_type}', 1, n_bins, lambda: fig.to_json(), rounds)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'machine': platform.machine(),
+            'numpy': np.__version__, 'pandas': pd.__version__,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def compare(results, base_results, threshold=THRESHOLD):
+    # prints the changes against base_results, returns the list of regressions
+    base = {(r['benchmark'], r['countries'], r['bins']): r for r in base_results}
+    regressions = []
+    print(f"\n{'benchmark':>26} {'countries':>9} {'bins':>6} {'time':>8} {'limit':>8} {'peak':>8}")
+    for result in results:
+        old = base.get((result['benchmark'], result['countries'], result['bins']))
+        if old is None:
+            continue
+        ratios = {}
+        # results written before the spread was recorded count as noise-free
+        limits = {'seconds': 1 + threshold + result.get('spread', 0) + old.get('spread', 0),
+                  'peak_bytes': 1 + threshold}
+        for field, noise in [('seconds', MIN_SECONDS), ('peak_bytes', MIN_BYTES)]:
+            ratios[field] = result[field] / old[field] if old[field] else float('inf')
+            gated = field != 'seconds' or old[field] >= GATE_MIN_SECONDS
+            if gated and ratios[field] > limits[field] and result[field] - old[field] > noise:
+                regressions.append((result['benchmark'], result['countries'], result['bins'], field))
+        limit = f"{limits['seconds']:>7.2f}x" if old['seconds'] >= GATE_MIN_SECONDS else f"{'-':>8}"
+        print(f"{result['benchmark']:>26} {result['countries']:>9} {result['bins']:>6} "
+              f"{ratios['seconds']:>7.2f}x {limit} {ratios['peak_bytes']:>7.2f}x")
+    for benchmark, n_countries, n_bins, field in regressions:
+        print(f"REGRESSION: {benchmark} ({n_countries} countries, {n_bins} bins) {field}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the figure pipeline on synthetic data')
+    parser.add_argument('--out', default=None, help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='results JSON of the commit to compare with')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='relative slowdown or memory growth counted as a regression')
+    parser.add_argument('--quick', action='store_true', help='small grid, for a quick check')
+    args = parser.parse_args()
+    if args.quick:
+        results = run_benchmarks(QUICK_COUNTRY_COUNTS, QUICK_BIN_COUNTS)
+    else:
+        results = run_benchmarks()
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            base_results = json.load(f)['results']
+        sys.exit(1 if compare(results, base_results, args.threshold) else 0)
@@ -1,485 +1,147 @@
-import os
 import json
 import streamlit as st
-import numpy as np
-import pandas as pd
-import plotly.graph_objects as go
-
-
-# constants
-local_grid = False
-y_label = 'Outcome'
-x_title, y_title = 'Transaction Volume', 'AUM'
-
-# titles
-
-#st.title('Country')
-st_country = st.sidebar.selectbox('Country', ['belgium', 'uk'], index=1)
-st_deciles_quintiles = st.sidebar.selectbox('Quantiles', ['deciles', 'quintiles'], index=1)
-st_orientation = st.sidebar.selectbox('Orientation', ['horizontal', 'vertical'], index=0)
-st_plot_type = st.sidebar.selectbox('Plot type', ['bars', 'bars and line', 'lines and delta'], index=1)
-st_fig_size_width = st.sidebar.selectbox('Plot width', [600, 800, 1000], index=1)
-st_fig_size_height = st.sidebar.selectbox('Plot height', [500, 600, 600, 1000], index=1)
-
-st_reverse_quantiles = st.sidebar.checkbox('Reverse quantile ordering')
-st_payment_negative = st.sidebar.checkbox('Plot payments as negative values')
-orientation = {'horizonal':'h',
-                'vertical': 'v'}.get(st_orientation, 'h')
-
-title_country_dict = {'belgium': 'Belgium',
-                        'uk': 'UK'}
-xlabel_quantile_dict = {'deciles': 'Income Decile',
-                        'quintiles': 'Income Quintile'}
-
-col_list = ['carbon revenue', 'carbon payment', 'net gain']
-
-rgb_dict = {'carbon payment': 'rgb(122, 138, 184)',
-            'carbon revenue': 'rgb(128, 179, 128)',
-            'net gain': 'rgb(69, 161, 69)'
-            }
-
-name_dict =  {'carbon payment': 'Payment',
-            'carbon revenue': 'Climate Income',
-            'net gain' : 'Net gain'}
-
-paper_bgcolor='rgb(248, 248, 255)'
-plot_bgcolor='rgb(248, 248, 255)'
-
-def load_data():
-    file_name = os.path.join(r'datasets', f'{st_country}.csv')
-    return pd.read_csv(file_name) #pd.read_csv(file_name, index_col='income decile')
-
-def load_metadata():
-    file_name = os.path.join(r'datasets/raw', f'{st_country}.json')
-    with open(file_name, "r") as jsonfile:
-        return(json.load(jsonfile))
-
-def change_to_quintiles(df):
-    df = df.groupby(np.arange(10)//2).mean()
-    df['income decile'] = np.arange(1, 6)
-    return df
-
-def make_barplot(df, meta_data, orientation='h', payment_negative=st_payment_negative):
-    #df = df.sort_values('income decile', ascending=True)
-    bargroupgap = 0.15
-    idx = df['income decile']
-    money_title, quantile_title = (f"Payment/Revenue ({meta_data['price_unit']}/year)",
-                                    xlabel_quantile_dict[st_deciles_quintiles])
-    x_axis_title = money_title if orientation == 'h' else quantile_title
-    y_axis_title = quantile_title if orientation == 'h' else money_title
-
-    fig = go.Figure()
-
-    for col in col_list:
-        rgb = rgb_dict.get(col, 'rgb(100,100,100)')
-        name = name_dict.get(col)
-        if orientation == 'v':
-            x = idx
-            if payment_negative and col == 'carbon payment':
-                y = - df[col]
-            else:
-                y = df[col]
-        else:
-            y = idx
-            if payment_negative and col == 'carbon payment':
-                x = - df[col]
-            else:
-                x = df[col]
-        fig.add_trace(go.Bar(x=x,
-                        y=y,
-                        name=name,
-                        marker_color=rgb,
-                        orientation=orientation
-                        ))
-    fig.update_traces(width=0.25)
-
-    # fig.show()
-    #fig.update_yaxes(categoryorder='array', categoryarray=np.arange(1, 6))
-    if st_reverse_quantiles:
-        if orientation == 'h':
-            fig.update_yaxes(autorange="reversed")
-        else:
-            fig.update_xaxes(autorange="reversed")
-
-    annotations = []
-    space = 0
-    for col_i, col in enumerate(col_list):
-        for i in range(0, len(idx)):
-            # labeling the rest of percentages for each bar (x_axis)
-            if orientation == 'h':
-                if col == 'carbon payment' and payment_negative:
-                    x_loc = - df.iloc[i, :][col]
-                else:
-                    x_loc = df.iloc[i][col]
-
-                y_loc = df.iloc[i, :]['income decile'] + (col_i - 1) * (bargroupgap + 0.125)
-                value = x_loc
-                x_loc = 0.5 * x_loc # placement of number in bar
-            else:
-                if col == 'carbon payment' and payment_negative:
-                    y_loc = - df.iloc[i, :][col]
-                else:
-                    y_loc = df.iloc[i][col]
-
-                x_loc = df.iloc[i, :]['income decile'] + (col_i - 1) * (bargroupgap + 0.125)
-                value = y_loc
-                y_loc = 0.5* y_loc  # placement of number in bar
-            annotations.append(dict(xref='x', yref='y',
-                                    x=space + x_loc, y=y_loc,
-                                    text= f'{value:.0f}' ,
-                                    font=dict(family='Arial', size=14,
-                                              color='rgb(240, 240, 250)'),
-                                    showarrow=False))
-    fig.update_layout(annotations=annotations)
-    if orientation == 'h':
-        xtickvals, ytickvals = None, np.arange(1, len(idx)+1)
+from datastore import registry
+from figcache import figure_cache
+import figures
+import metrics
+import prefetch
+from currency import target_units, DEFAULT_YEAR
+
+
+def session_id():
+    # the Streamlit session of this script run, None outside of one
+    from streamlit.report_thread import get_report_ctx
+    ctx = get_report_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def sidebar_options():
+    #st.title('Country')
+    country_options = figures.countries()
+    st_country = st.sidebar.selectbox('Country', country_options,
+                                      index=figures.default_country_index(country_options))
+    quantile_choices = figures.quantile_choices(st_country)
+    st_deciles_quintiles = st.sidebar.selectbox('Quantiles', quantile_choices,
+                                                index=quantile_choices.index('quintiles')
+                                                if 'quintiles' in quantile_choices else 0)
+    st_orientation = st.sidebar.selectbox('Orientation', list(figures.orientation_options), index=0)
+    st_plot_type = st.sidebar.selectbox('Plot type', figures.plot_type_options, index=1)
+    st_fig_size_width = st.sidebar.selectbox('Plot width', figures.width_options, index=1)
+    st_fig_size_height = st.sidebar.selectbox('Plot height', figures.height_options, index=1)
+
+    st_reverse_quantiles = st.sidebar.checkbox('Reverse quantile ordering')
+    st_payment_negative = st.sidebar.checkbox('Plot payments as negative values')
+    base_metadata = registry.load_metadata(st_country)
+    base_price = float(base_metadata['price'])
+    st_price = st.sidebar.slider(f"Carbon price ({base_metadata['price_unit']}/tCO2)",
+                                 0., figures.MAX_PRICE_FACTOR * base_price, base_price,
+                                 step=figures.price_step(base_price))
+    st_uncertainty = st.sidebar.checkbox('Show uncertainty bands (5-95%)') \
+        if figures.has_error_estimates(st_country) else False
+    st_currency = st.sidebar.selectbox('Display currency', ['local'] + target_units, index=0)
+    return dict(country=st_country, quantiles=st_deciles_quintiles,
+                orientation=figures.orientation_options[st_orientation], plot_type=st_plot_type,
+                width=st_fig_size_width, height=st_fig_size_height,
+                reverse=st_reverse_quantiles, payment_negative=st_payment_negative,
+                price=st_price, uncertainty=st_uncertainty,
+                currency=None if st_currency == 'local' else st_currency)
+
+def trajectory_figure(options):
+    # bars animated along a rising price, starting at the price slider; plays without reruns
+    base_price = float(registry.load_metadata(options['country'])['price'])
+    step = figures.price_step(base_price)
+    st_increase = st.sidebar.slider('Price increase per year', 0., base_price,
+                                    max(round(base_price / 4, 0 if step == 1 else 1), step), step=step)
+    st_years = st.sidebar.slider('Years', 2, 30, 10)
+    return figures.trajectory_json(options['country'], options['quantiles'], options['orientation'],
+                                   options['width'], options['height'], options['reverse'],
+                                   options['payment_negative'], options['price'],
+                                   st_increase, st_years, options['currency'])
+
+def debug_panel():
+    # timings of this run and the cache counters, set CLIMATEINCOME_DEBUG=1 to show
+    with st.sidebar.beta_expander('Debug: timings'):
+        spans = metrics.run_spans()
+        st.text('\n'.join(f'{stage:<10} {1e3 * seconds:8.1f} ms' for stage, seconds in spans)
+                + f"\n{'total':<10} {1e3 * sum(seconds for _, seconds in spans):8.1f} ms")
+        # JSON size of the figures of this run, before and after the encoding stage
+        st.text('\n'.join(f'payload    {raw / 1e3:8.1f} kB -> {encoded / 1e3:.1f} kB ({encoded / raw:.0%})'
+                          for raw, encoded in metrics.run_payloads()))
+        st.text(f'registry: {registry.stats()}\nfigure cache: {figure_cache.stats()}'
+                f'\nprefetch: {prefetch.prefetcher.stats()}')
+
+def household_panel(options):
+    # payment, dividend and net gain of the user's own household, for datasets with categories;
+    # imported here, household loads numpy, pandas and pyarrow
+    import household
+    intensities = household.implied_intensities(options['country'])
+    if intensities is None:
+        return
+    unit = registry.load_metadata(options['country'])['price_unit']
+    with st.beta_expander('Your household'):
+        spend = {column: st.number_input(f'Yearly spend on {column} ({unit})', min_value=0.,
+                                         value=float(round(default, -1)), step=100.)
+                 for column, default in household.average_spend(options['country']).items()}
+        result = household.household(spend, options['country'], options['price'], intensities)
+        st.write(f"Carbon payment: {result['carbon payment']:.0f} {unit}/year, "
+                 f"climate income: {result['carbon revenue']:.0f} {unit}/year, "
+                 f"net gain: {round(result['net gain']) + 0:.0f} {unit}/year")
+        st.write(f"Starts at the average household spend: {household.load_spend(options['country'])['source']}")
+
+def comparison_view():
+    country_options = figures.countries()
+    st_countries = st.sidebar.multiselect('Countries', country_options, default=country_options)
+    st_deciles_quintiles = st.sidebar.selectbox('Quantiles', figures.quantile_options, index=1)
+    st_fig_size_width = st.sidebar.selectbox('Plot width', figures.width_options, index=2)
+    st_normalization = st.sidebar.selectbox('Amounts', ['relative to average payment'] + target_units,
+                                            index=0)
+    currency = None if st_normalization == 'relative to average payment' else st_normalization
+    if not st_countries:
+        st.write('Select one or more countries to compare.')
+        return
+    figure = figures.comparison_json(st_countries, st_deciles_quintiles, st_fig_size_width, currency)
+    with metrics.span('render'):
+        st.plotly_chart(json.loads(figure))
+    if currency is None:
+        st.write('Amounts are relative to the average carbon payment in each country, '
+                 'shown next to the country name.')
     else:
-        xtickvals, ytickvals = np.arange(1, len(idx)+1), None
-
-    fig.update_layout(
-        title=dict(
-            text=f'Yearly carbon fee and carbon revenue, {title_country_dict.get(st_country)}',
-            xanchor='center',
-            x=0.5,
-        ),
-        titlefont_size=20,
-        yaxis=dict(
-            title=y_axis_title,
-            titlefont_size=16,
-            tickfont_size=14,
-            tickvals=ytickvals
-        ),
-        xaxis=dict(
-            title=x_axis_title,
-            titlefont_size=16,
-            tickvals=xtickvals
-        ),
-        legend=dict(
-            x=1.0,
-            y=1.05,
-            bgcolor='rgba(200, 200, 210, 0.15)',
-            bordercolor='rgba(255, 255, 255, 0)'
-        ),
-        barmode='group',
-        bargap=0.15, # gap between bars of adjacent location coordinates.
-        bargroupgap=bargroupgap, # gap between bars of the same location coordinate.,
-        paper_bgcolor=paper_bgcolor,
-        plot_bgcolor=paper_bgcolor,
-        width=st_fig_size_width,
-        height=st_fig_size_height,
-    )
-    st.plotly_chart(fig)
-
-
-
-def make_bar_lineplot(df, meta_data, orientation='h', payment_negative=st_payment_negative):
-    #df = df.sort_values('income decile', ascending=True)
-    bargroupgap = 0.15
-    idx = df['income decile']
-    money_title, quantile_title = (f"Payment/Revenue ({meta_data['price_unit']}/year)",
-                                    xlabel_quantile_dict[st_deciles_quintiles])
-    x_axis_title = money_title if orientation == 'h' else quantile_title
-    y_axis_title = quantile_title if orientation == 'h' else money_title
-
-    fig = go.Figure()
-
-    for col in col_list:
-        rgb = rgb_dict.get(col, 'rgb(100,100,100)')
-        name = name_dict.get(col)
-
-        if orientation == 'v':
-            x = idx
-            if payment_negative and col == 'carbon payment':
-                y = - df[col]
-            else:
-                y = df[col]
-        else:
-            y = idx
-            if payment_negative and col == 'carbon payment':
-                x = - df[col]
-            else:
-                x = df[col]
-        if col =='carbon revenue':
-            if orientation == 'v':
-                x_min = x.min() - 0.5
-                x_max = x.max() + 0.5
-                y_min = y.min()
-                y_max = y.max()
-
-            else:
-                x_min = x.min()
-                x_max = x.max()
-                y_min = y.min() - 0.5
-                y_max = y.max() + 0.5
-            fig.add_trace(go.Scatter(x=[x_min, x_max],
-                            y=[y_min, y_max],
-                            name=name,
-                            orientation=orientation,
-                            line_color=rgb,
-                            line_width=3,
-                            #text = ['carbon revenue'] + ['']*(len(df)-1),
-                            marker=dict(size=1),
-                            mode='lines+markers'
-                            ))
-        else:
-            fig.add_trace(go.Bar(x=x,
-                            y=y,
-                            name=name,
-                            marker_color=rgb,
-                            orientation=orientation,
-                            width=0.4
-                            ))
-
-
-    # fig.show()
-    #fig.update_yaxes(categoryorder='array', categoryarray=np.arange(1, 6))
-    if st_reverse_quantiles:
-        if orientation == 'h':
-            fig.update_yaxes(autorange="reversed")
-        else:
-            fig.update_xaxes(autorange="reversed")
-
-    annotations = []
-    space = 0
-    for col_i, col in enumerate([col_list[1], col_list[2]]):
-        for i in range(0, len(idx)):
-            # labeling the rest of percentages for each bar (x_axis)
-            if orientation == 'h':
-                if col == 'carbon payment' and payment_negative:
-                    x_loc = - df.iloc[i, :][col]
-                else:
-                    x_loc = df.iloc[i][col]
-
-                y_loc = df.iloc[i, :]['income decile'] + (col_i - 0.5) * (bargroupgap + 0.2)
-                value = x_loc
-                x_loc = 0.5 * x_loc # placement of number in bar
-            else:
-                if col == 'carbon payment' and payment_negative:
-                    y_loc = - df.iloc[i, :][col]
-                else:
-                    y_loc = df.iloc[i][col]
-
-                x_loc = df.iloc[i, :]['income decile'] + (col_i - 0.5) * (bargroupgap + 0.2)
-                value = y_loc
-                y_loc = 0.5* y_loc  # placement of number in bar
-            annotations.append(dict(xref='x', yref='y',
-                                    x=space + x_loc, y=y_loc,
-                                    text= f'{value:.0f}' ,
-                                    font=dict(family='Arial', size=14,
-                                              color='rgb(240, 240, 250)'),
-                                    showarrow=False))
-    # add line text
-    col_i, col = 0, col_list[0]
-    if orientation == 'h':
-        x_loc = df.loc[:, col].mean()
-        y_loc = idx.mean()
-        value = x_loc
-        textangle = 90
-    else:
-        y_loc = df.loc[:, col].mean()
-        x_loc = idx.mean()
-        value = y_loc
-        textangle = 0
-    annotations.append(dict(xref='x', yref='y',
-                            x=space + x_loc, y=y_loc,
-                            xanchor='center',
-                            yanchor='bottom',
-                            text= f'Climate Income: {value:.0f}',
-                            font=dict(family='Arial', size=16,
-                                      color="rgb(240, 250, 240)"),
-                            showarrow=False,
-                            textangle=textangle,
-                            bgcolor=rgb_dict.get('carbon revenue', 'rgb(100,100,100)'),
-                            opacity=0.9
-                            ))
-
-
-    fig.update_layout(annotations=annotations)
-    if orientation == 'h':
-        xtickvals, ytickvals = None, np.arange(1, len(idx)+1)
+        st.write(f'Amounts are converted with {DEFAULT_YEAR} exchange rates (ECB) or purchasing power '
+                 'parities (OECD). The average carbon payment is shown next to the country name.')
+
+def main():
+    metrics.start_run()
+    metrics.start_metrics_server()
+    prefetch.start()
+    if st.sidebar.checkbox('Compare countries'):
+        comparison_view()
+        if metrics.DEBUG:
+            debug_panel()
+        return
+    options = sidebar_options()
+    #if st.checkbox('Show dataframe'):
+    # the figure only depends on the sidebar state and the dataset version
+    # only the stages whose inputs changed are recomputed, see figures.STAGE_INPUTS
+    if st.sidebar.checkbox('Price trajectory'):
+        figure = json.loads(trajectory_figure(options))
+    elif st.sidebar.checkbox('Revenue recycling'):
+        figure = json.loads(figures.recycling_json(options['country'], options['quantiles'],
+                                                   options['price'], options['currency'],
+                                                   options['width'], options['height']))
     else:
-        xtickvals, ytickvals = np.arange(1, len(idx)+1), None
-
-    fig.update_layout(
-        title=dict(
-            text=f'Yearly carbon fee and carbon revenue, {title_country_dict.get(st_country)}',
-            xanchor='center',
-            x=0.5,
-        ),
-        titlefont_size=20,
-        yaxis=dict(
-            title=y_axis_title,
-            titlefont_size=16,
-            tickfont_size=14,
-            tickvals=ytickvals
-        ),
-        xaxis=dict(
-            title=x_axis_title,
-            titlefont_size=16,
-            tickvals=xtickvals
-        ),
-        legend=dict(
-            x=1.0,
-            y=1.05,
-            bgcolor='rgba(200, 200, 210, 0.15)',
-            bordercolor='rgba(255, 255, 255, 0)'
-        ),
-        barmode='group',
-        bargap=0.15, # gap between bars of adjacent location coordinates.
-        bargroupgap=bargroupgap, # gap between bars of the same location coordinate.,
-        paper_bgcolor=paper_bgcolor,
-        plot_bgcolor=paper_bgcolor,
-        width=st_fig_size_width,
-        height=st_fig_size_height,
-    )
-    st.plotly_chart(fig)
-
-
-def make_line_delta_plot(df, meta_data, orientation='h'):
-    line_col_list = ['carbon revenue', 'carbon payment']
-
-    #df = df.sort_values('income decile', ascending=True)
-    bargroupgap = 0.15
-    idx = df['income decile']
-    money_title, quantile_title = (f"Payment/Revenue ({meta_data['price_unit']}/year)",
-                                    xlabel_quantile_dict[st_deciles_quintiles])
-    x_axis_title = money_title if orientation == 'h' else quantile_title
-    y_axis_title = quantile_title if orientation == 'h' else money_title
-
-    fig = go.Figure()
-    for col in line_col_list:
-        rgb = rgb_dict.get(col, 'rgb(100,100,100)')
-        name = name_dict.get(col)
-
-        if orientation == 'v':
-            x = idx
-            y = df[col]
-            values = y
-        else:
-            y = idx
-            x = df[col]
-            values = x
-
-        text_array = [f'{val:.0f}' for val in values] if col == 'carbon payment' else \
-                [f'{val:.0f}' if i == 0 else '' for i, val in enumerate(values)]
-        mode = 'lines+markers+text' if col == 'carbon payment' else 'lines+markers+text'
-
-        textposition = "top center" if orientation == 'h' else "middle left"
-        fig.add_trace(go.Scatter(x=x,
-                        y=y,
-                        name=name,
-                        orientation=orientation,
-                        line_color=rgb,
-                        line_width=3,
-                        marker=dict(size=20),
-                        mode=mode,
-                        text=text_array,
-                        textfont=dict(size=15),
-                        textposition=textposition,
-                        ))
-
-
-    # fig.show()
-    #fig.update_yaxes(categoryorder='array', categoryarray=np.arange(1, 6))
-    if st_reverse_quantiles:
-        if orientation == 'h':
-            fig.update_yaxes(autorange="reversed")
-        else:
-            fig.update_xaxes(autorange="reversed")
-
-    annotations = []
-    space = 0
-    for i, (y0, y1) in enumerate(zip(df['carbon payment'], df['carbon revenue'])):
-        value = y1 - y0
-        if orientation == 'h':
-            x_min, x_max = y0, y1
-            y_min, y_max = i + 1, i + 1
-        else:
-            y_min, y_max = y0, y1
-            x_min, x_max = i + 1, i + 1
-
-        # Add arrow
-        annotations.append(dict(xref='x', yref='y',
-                                ax=x_min, x=x_max,
-                                ay=y_min, y=y_max,
-                                axref='x', ayref='y',
-                                text= "",#f'{value:.0f}' ,
-                                font=dict(family='Arial', size=14,
-                                          color=rgb_dict.get('carbon revenue')),
-                                xanchor='left',
-                                yanchor='bottom',
-                                arrowhead = 5,
-                                arrowwidth=4,
-                                arrowcolor=rgb_dict.get('net gain'),
-                                showarrow=True))
-        # Add text
-        annotations.append(dict(xref='x', yref='y',
-                                x=(x_min+x_max)/2,
-                                y=(y_min+y_max)/2,
-                                xanchor='left',
-                                yanchor='top',
-                                text= f'{value:.0f}',
-                                font=dict(family='Arial', size=16,
-                                          color="rgb(240, 250, 240)"),
-                                showarrow=False,
-                                textangle=0,
-                                bgcolor=rgb_dict.get('carbon revenue', 'rgb(100,100,100)'),
-                                opacity=0.8
-                                ))
-
-
-    fig.update_layout(annotations=annotations)
-    if orientation == 'h':
-        xtickvals, ytickvals = None, np.arange(1, len(idx)+1)
-    else:
-        xtickvals, ytickvals = np.arange(1, len(idx)+1), None
-
-    fig.update_layout(
-        title=dict(
-            text=f'Yearly carbon fee and carbon revenue, {title_country_dict.get(st_country)}',
-            xanchor='center',
-            x=0.5,
-        ),
-        titlefont_size=20,
-        yaxis=dict(
-            title=y_axis_title,
-            titlefont_size=16,
-            tickfont_size=14,
-            tickvals=ytickvals
-        ),
-        xaxis=dict(
-            title=x_axis_title,
-            titlefont_size=16,
-            tickvals=xtickvals
-        ),
-        legend=dict(
-            x=1.0,
-            y=1.05,
-            bgcolor='rgba(200, 200, 210, 0.15)',
-            bordercolor='rgba(255, 255, 255, 0)'
-        ),
-        barmode='group',
-        bargap=0.15, # gap between bars of adjacent location coordinates.
-        bargroupgap=bargroupgap, # gap between bars of the same location coordinate.,
-        paper_bgcolor=paper_bgcolor,
-        plot_bgcolor=paper_bgcolor,
-        width=st_fig_size_width,
-        height=st_fig_size_height,
-    )
-    st.plotly_chart(fig)
-
-
-#if st.checkbox('Show dataframe'):
-chart_data = load_data()
-if st_deciles_quintiles == 'quintiles':
-    chart_data = change_to_quintiles(chart_data)
-meta_data = load_metadata()
-
-if st_plot_type == 'bars':
-    make_barplot(chart_data, meta_data, orientation=orientation)
-elif st_plot_type == 'bars and line':
-    make_bar_lineplot(chart_data, meta_data, orientation=orientation)
-else:
-    make_line_delta_plot(chart_data, meta_data, orientation=orientation)
-meta_data['text']
-meta_data['origin']
+        prefetch.prefetcher.served(options)
+        figure = figures.figure_dict(**options)
+    with metrics.span('render'):
+        st.plotly_chart(figure)
+    # the likely next views are built in the background while the user looks at this one
+    prefetch.prefetcher.prefetch_next(options, session_id())
+    meta_data = registry.load_metadata(options['country'])
+    st.write(meta_data['text'])
+    st.write(meta_data['origin'])
+    household_panel(options)
+    if metrics.DEBUG:
+        debug_panel()
+
+
+# streamlit runs this file as __main__; importing it has no side effects
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import numpy as np
+import plotly.graph_objects as go
+from cube import load_cube
+from datastore import registry
+from metrics import span
+from figures import QUANTILE_BINS
+from plots import name_dict, rgb_dict, title_country_dict, quantile_title, paper_bgcolor
+
+# Small multiples of several countries side by side: one selection from the
+# dataset cube of the selected countries (see cube.py), one subplot per country
+# on shared axes. Countries without usable data are left out and named below
+# the figure. Amounts are divided by
+# the country's average carbon payment, so countries with different
+# currencies and price levels share one (unitless) axis, or converted to a
+# common currency unit (see currency.py).
+
+comparison_cols = ['carbon payment', 'net gain', 'carbon revenue']
+MAX_COLUMNS = 5
+ROW_HEIGHT = 220
+
+
+def comparison_arrays(countries, quantiles='deciles', currency=None):
+    """Normalized values of several countries as flat columnar arrays.
+
+    Returns a dict with 'countries', 'codes' (country position per row),
+    'idx' (quantile per row), 'values' (len(comparison_cols), n_rows array,
+    rows sorted by country and quantile), 'mean_payment' per country and
+    'unit' (None for amounts relative to the average payment) and 'skipped'
+    ({country: reason} of the countries left out).
+    """
+    with span('load'):
+        cube = load_cube(countries)
+    skipped = {}
+    for country in countries:
+        if country not in cube.country_index:
+            skipped[country] = cube.skipped.get(country, 'no data, run process_rawdata.py first')
+        elif not set(comparison_cols) <= set(cube.columns[country]):
+            skipped[country] = f"its data lacks one of {comparison_cols}"
+    countries = [country for country in countries if country not in skipped]
+    if not countries:
+        raise ValueError(f"no data to compare: {skipped}")
+    # (country, quantile, column) in the requested country order; the rows of a country
+    # are its first counts[country] quantiles, the rest of the cube is NaN padding
+    selection = cube.sel(country=list(countries), metric=comparison_cols)
+    counts = cube.n_quantiles[[cube.country_index[country] for country in countries]]
+    rows = np.arange(len(cube.quantiles)) < counts[:, None]
+    codes = np.nonzero(rows)[0]
+    idx = np.broadcast_to(cube.quantiles, rows.shape)[rows]
+    values = selection[rows].T
+    n_bins = QUANTILE_BINS[quantiles]
+    if (counts > n_bins).any():
+        # same grouping as figures.change_to_quantiles, for all countries at once;
+        # countries with at most n_bins bins keep theirs
+        grouped = np.minimum(counts, n_bins)
+        starts = np.cumsum(grouped) - grouped
+        key = starts[codes] + (idx - 1) * grouped[codes] // counts[codes]
+        sizes = np.bincount(key, minlength=grouped.sum())
+        values = np.vstack([np.bincount(key, weights=row, minlength=len(sizes)) / sizes
+                            for row in values])
+        codes = np.repeat(np.arange(len(countries)), grouped)
+        idx = np.arange(len(codes)) - starts[codes] + 1
+        counts = grouped
+    if currency is not None:
+        from currency import conversion_factors
+        values = values * conversion_factors(countries, currency)[codes]
+    payment = values[comparison_cols.index('carbon payment')]
+    mean_payment = np.bincount(codes, weights=payment) / counts
+    if currency is None:
+        values = values / mean_payment[codes]
+    return dict(countries=list(countries), codes=codes, idx=idx, values=values,
+                mean_payment=mean_payment, counts=counts, unit=currency, skipped=skipped)
+
+def grid_layout(n_panels, n_cols, titles, h_spacing=0.02, v_spacing=0.08):
+    """Axes and title annotations of a grid of subplots with matching axes.
+
+    Written out directly instead of with plotly.subplots.make_subplots,
+    which spends seconds validating the axes of a few dozen subplots.
+    """
+    n_rows = -(-n_panels // n_cols)
+    panel_width = (1 - (n_cols - 1) * h_spacing) / n_cols
+    panel_height = (1 - (n_rows - 1) * v_spacing) / n_rows
+    layout, annotations = {}, []
+    for i, title in enumerate(titles):
+        row, col = divmod(i, n_cols)
+        suffix = '' if i == 0 else str(i + 1)
+        x0 = col * (panel_width + h_spacing)
+        y1 = 1 - row * (panel_height + v_spacing)
+        # clipped, rounding may step just outside [0, 1]
+        layout[f'xaxis{suffix}'] = dict(anchor=f'y{suffix}', domain=[x0, min(x0 + panel_width, 1)],
+                                        matches=None if i == 0 else 'x',
+                                        showticklabels=i + n_cols >= n_panels)
+        layout[f'yaxis{suffix}'] = dict(anchor=f'x{suffix}', domain=[max(y1 - panel_height, 0), y1],
+                                        matches=None if i == 0 else 'y',
+                                        showticklabels=col == 0)
+        annotations.append(dict(text=title, x=x0 + panel_width / 2, y=y1, xref='paper', yref='paper',
+                                xanchor='center', yanchor='bottom', showarrow=False,
+                                font=dict(size=12)))
+    return layout, annotations
+
+def comparison_traces(arrays):
+    # 3 traces per country, one legend entry per column
+    bounds = np.cumsum(arrays['counts'])[:-1]
+    idx_split = np.split(arrays['idx'], bounds)
+    value_split = np.split(arrays['values'], bounds, axis=1)
+    traces = []
+    for i, (idx, values) in enumerate(zip(idx_split, value_split)):
+        axis = '' if i == 0 else str(i + 1)
+        common = dict(x=idx, xaxis=f'x{axis}', yaxis=f'y{axis}', showlegend=i == 0)
+        traces += [dict(type='bar', y=values[0], name=name_dict['carbon payment'],
+                        legendgroup='payment', marker_color=rgb_dict['carbon payment'], **common),
+                   dict(type='bar', y=values[1], name=name_dict['net gain'],
+                        legendgroup='net gain', marker_color=rgb_dict['net gain'], **common),
+                   dict(type='scatter', y=values[2], name=name_dict['carbon revenue'],
+                        legendgroup='revenue', mode='lines',
+                        line=dict(color=rgb_dict['carbon revenue'], width=3), **common)]
+    return traces
+
+def comparison_figure(arrays, width=1000):
+    countries = arrays['countries']
+    n_cols = min(len(countries), MAX_COLUMNS)
+    n_rows = -(-len(countries) // n_cols)
+    if arrays['unit'] is None:
+        units = [registry.load_metadata(country)['price_unit'] for country in countries]
+        y_title = 'Relative to the average payment'
+    else:
+        units = [arrays['unit']] * len(countries)
+        y_title = f"Payment/Revenue ({arrays['unit']}/year)"
+    titles = [f"{title_country_dict.get(country, country)} ({mean:.0f} {unit})"
+              for country, mean, unit in zip(countries, arrays['mean_payment'], units)]
+    axes, annotations = grid_layout(len(countries), n_cols, titles,
+                                    v_spacing=min(0.3 / n_rows, 0.08))
+    counts = set(arrays['counts'].tolist())
+    annotations += [dict(text=quantile_title(counts.pop() if len(counts) == 1 else None), x=0.5, y=0, xref='paper', yref='paper',
+                         xanchor='center', yanchor='top', yshift=-30, showarrow=False,
+                         font=dict(size=16)),
+                    dict(text=y_title, x=0, y=0.5, xref='paper',
+                         yref='paper', xanchor='right', yanchor='middle', xshift=-40, textangle=-90,
+                         showarrow=False, font=dict(size=16))]
+    if arrays['skipped']:
+        annotations.append(dict(text='Not shown: ' + ', '.join(
+                                    title_country_dict.get(country, country)
+                                    for country in arrays['skipped']),
+                                x=0, y=0, xref='paper', yref='paper', xanchor='left', yanchor='top',
+                                yshift=-55, showarrow=False, font=dict(size=12)))
+    fig = go.Figure(layout=dict(
+        axes,
+        annotations=annotations,
+        title=dict(text='Yearly carbon fee and carbon revenue, by country', xanchor='center', x=0.5),
+        titlefont_size=20,
+        barmode='group',
+        bargap=0.15,
+        legend=dict(orientation='h', x=0.5, xanchor='center', y=1, yanchor='bottom'),
+        margin=dict(t=140),
+        paper_bgcolor=paper_bgcolor,
+        plot_bgcolor=paper_bgcolor,
+        width=width,
+        height=ROW_HEIGHT * n_rows + 200,
+    ))
+    # one add_traces call: validating the traces against an existing layout is much
+    # cheaper than passing them to the constructor together with it
+    fig.add_traces(comparison_traces(arrays))
+    return fig
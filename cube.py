@@ -0,0 +1,238 @@
+import threading
+from collections import OrderedDict
+import tracemalloc
+import numpy as np
+import pandas as pd
+from datastore import registry
+
+# Datasets of several countries in one read-only float array of shape
+# (country, quantile, metric), with label indexes for the three dimensions and
+# the metadata of every country (from the metadata JSON files). Metrics a
+# country does not have, and quantiles beyond its number of quantiles, are NaN.
+#   cube = load_cube(['belgium', 'uk'])
+#   cube.sel(metric='net gain')           # (country, quantile) view, no copy
+#   cube.ranks('net gain')                # rank of every country per quantile
+#   make_barplot(cube.frame('uk'), cube.meta_data('uk'))
+# frame() is a DataFrame on the cube's memory, in the schema of
+# datasets/<country>.csv. The cube is a copy of the registry's data, so the
+# single-country charts read the registry; comparison.comparison_arrays reads
+# the selected countries from their cube at once.
+
+QUANTILE_COL = 'income decile'
+# every processed dataset has them
+BASE_METRICS = ['carbon payment', 'carbon revenue', 'net gain']
+
+CUBE_ENTRIES = 8
+
+_lock = threading.Lock()
+_cubes = OrderedDict()  # ((country, dataset version), ...) -> cube
+
+
+class DatasetCube:
+    """values[country, quantile, metric] with the labels in countries, quantiles and metrics.
+
+    has_metric[country, metric] tells which metrics a country's data has,
+    n_quantiles[country] its number of quantiles, metadata[country] its metadata,
+    columns[country] its metrics in the order of its data (metric order if not given)
+    and skipped {country: reason} the countries left out.
+    """
+
+    def __init__(self, values, countries, quantiles, metrics, has_metric, n_quantiles, metadata,
+                 versions=None, columns=None, skipped=None):
+        values.flags.writeable = False
+        self.values = values
+        self.countries = list(countries)
+        self.quantiles = np.asarray(quantiles)
+        self.metrics = list(metrics)
+        self.has_metric = has_metric
+        self.n_quantiles = np.asarray(n_quantiles)
+        self.metadata = metadata
+        self.versions = versions
+        self.columns = columns if columns is not None else \
+            {country: [metric for metric, has in zip(self.metrics, row) if has]
+             for country, row in zip(self.countries, has_metric)}
+        self.skipped = skipped or {}
+        self.country_index = {country: i for i, country in enumerate(self.countries)}
+        self.metric_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.quantile_index = {quantile: i for i, quantile in enumerate(self.quantiles.tolist())}
+
+    @classmethod
+    def from_frames(cls, frames, metadata, versions=None, skipped=None):
+        """The cube of frames and metadata, {country: DataFrame in the datasets/<country>.csv
+        schema} and {country: dict}.
+
+        Countries whose quantiles are not 1 to their number of quantiles are left
+        out, with the reason in skipped (which may hold earlier ones).
+        """
+        skipped = dict(skipped or {})
+        for country, df in frames.items():
+            if not np.array_equal(df[QUANTILE_COL].to_numpy(), np.arange(1, len(df) + 1)):
+                skipped[country] = f"its quantiles are not 1 to {len(df)}"
+        frames = {country: df for country, df in frames.items() if country not in skipped}
+        countries = list(frames)
+        # the base metrics, then the others in the order of the first country that has them
+        metrics = list(BASE_METRICS)
+        columns = {}
+        for country, df in frames.items():
+            columns[country] = [col for col in df.columns
+                                if col != QUANTILE_COL and pd.api.types.is_numeric_dtype(df[col])]
+            metrics += [col for col in columns[country] if col not in metrics]
+        n_quantiles = [len(df) for df in frames.values()]
+        quantiles = np.arange(1, max(n_quantiles, default=0) + 1)
+        values = np.full((len(countries), len(quantiles), len(metrics)), np.nan)
+        has_metric = np.zeros((len(countries), len(metrics)), dtype=bool)
+        for i, (country, df) in enumerate(frames.items()):
+            positions = [metrics.index(col) for col in columns[country]]
+            values[i, :len(df), positions] = df[columns[country]].to_numpy(dtype=float).T
+            has_metric[i, positions] = True
+        # shared with the registry, a DataFrame of a few strings per country takes more than the values
+        return cls(values, countries, quantiles, metrics, has_metric, n_quantiles,
+                   {country: metadata[country] for country in countries}, versions, columns, skipped)
+
+    def _position(self, index, label):
+        # label -> int, slice or list of ints; None selects everything
+        if label is None:
+            return slice(None)
+        if isinstance(label, slice):
+            start = index[label.start] if label.start is not None else None
+            stop = index[label.stop] + 1 if label.stop is not None else None
+            return slice(start, stop)
+        if isinstance(label, (list, tuple, np.ndarray)):
+            return [index[item] for item in label]
+        return index[label]
+
+    def sel(self, country=None, quantile=None, metric=None):
+        """values by label: a single label or a label slice (inclusive) selects a view,
+        a list of labels a copy."""
+        key = (self._position(self.country_index, country),
+               self._position(self.quantile_index, quantile),
+               self._position(self.metric_index, metric))
+        lists = [position for position in key if isinstance(position, list)]
+        if len(lists) > 1:
+            # numpy would pair the lists up element by element
+            return self.values[np.ix_(*[position if isinstance(position, list) else
+                                        np.arange(size)[position]
+                                        for position, size in zip(key, self.values.shape)])]
+        return self.values[key]
+
+    def meta_data(self, country):
+        # the metadata of a country, as registry.load_metadata returns it
+        return self.metadata[country]
+
+    def metadata_table(self, columns=None):
+        # the metadata as a table with one row per country, prices as floats
+        table = pd.DataFrame([dict(self.metadata[country]) for country in self.countries],
+                             index=pd.Index(self.countries, name='country'), columns=columns)
+        if 'price' in table.columns:
+            table['price'] = table['price'].astype(float)
+        return table
+
+    def frame(self, country):
+        """The data of a country as a DataFrame in the schema of datasets/<country>.csv.
+
+        The float columns are a view on the cube when the country's metrics are
+        adjacent and in its column order in the metric dimension, else a copy of
+        its (quantile, metric) slice.
+        """
+        i = self.country_index[country]
+        positions = [self.metric_index[metric] for metric in self.columns[country]]
+        block = self.values[i, :self.n_quantiles[i]]
+        if positions and positions == list(range(positions[0], positions[0] + len(positions))):
+            block = block[:, positions[0]:positions[-1] + 1]
+        else:
+            block = block[:, positions]
+        df = pd.DataFrame(block, columns=self.columns[country], copy=False)
+        df.insert(0, QUANTILE_COL, self.quantiles[:self.n_quantiles[i]])
+        return df
+
+    # vectorized over all countries, (country, quantile) arrays
+
+    def normalized(self, metric, by='carbon payment'):
+        # metric relative to the country's average of `by`, as in the comparison view
+        return self.sel(metric=metric) / np.nanmean(self.sel(metric=by), axis=1, keepdims=True)
+
+    def delta(self, metric, reference):
+        # metric minus the reference country's, quantile by quantile
+        values = self.sel(metric=metric)
+        return values - values[self.country_index[reference]]
+
+    def ranks(self, metric, descending=True):
+        # 0 for the country with the largest (or smallest) value in each quantile, NaN last
+        values = self.sel(metric=metric)
+        values = np.where(np.isnan(values), -np.inf if descending else np.inf, values)
+        order = np.argsort(-values if descending else values, axis=0, kind='stable')
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(len(self.countries))[:, None], axis=0)
+        return ranks
+
+    def converted(self, metric, target, year=None):
+        # a money metric in a common currency unit, see currency.py
+        from currency import DEFAULT_YEAR, conversion_factors
+        factors = conversion_factors(self.countries, target, DEFAULT_YEAR if year is None else year)
+        return self.sel(metric=metric) * factors[:, None]
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.has_metric.nbytes + self.quantiles.nbytes
+
+
+def load_cube(countries=None):
+    """The cube of the countries, all of the registry's if None.
+
+    Countries that cannot be loaded are left out, with the error in cube.skipped.
+    The CUBE_ENTRIES most recently used cubes are cached on the dataset versions.
+    """
+    countries = registry.countries() if countries is None else list(countries)
+    versions, skipped = [], {}
+    for country in countries:
+        try:
+            versions.append((country, registry.version(country)))
+        except OSError as e:
+            skipped[country] = str(e)
+    key = tuple(versions)
+    with _lock:
+        cube = _cubes.get(key)
+        if cube is not None:
+            _cubes.move_to_end(key)
+            return cube
+    frames, metadata = {}, {}
+    for country, _ in versions:
+        try:
+            frames[country], metadata[country] = registry.load_data(country), registry.load_metadata(country)
+        except (OSError, KeyError, ValueError) as e:
+            skipped[country] = str(e)
+    cube = DatasetCube.from_frames(frames, metadata, key, skipped)
+    with _lock:
+        _cubes[key] = cube
+        while len(_cubes) > CUBE_ENTRIES:
+            _cubes.popitem(last=False)
+    return cube
+
+
+def traced_bytes(build):
+    # bytes allocated by build() and still held by its result
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+if __name__ == '__main__':
+    cube = load_cube()
+    # the data as the registry holds it, one DataFrame per country, against the cube;
+    # both share the registry's metadata
+    frame_bytes = traced_bytes(lambda: {country: registry.load_data(country).copy()
+                                        for country in cube.countries})
+    cube_bytes = traced_bytes(lambda: DatasetCube.from_frames(
+        {country: registry.load_data(country) for country in cube.countries},
+        {country: registry.load_metadata(country) for country in cube.countries}))
+    print(f"cube {cube.values.shape} (country, quantile, metric): {cube_bytes} bytes "
+          f"({cube.nbytes} of values), {len(cube.countries)} DataFrames: {frame_bytes} bytes")
+    print(cube.metadata_table(['price', 'price_unit']))
+    ranks = cube.ranks('net gain')
+    for j, quantile in enumerate(cube.quantiles):
+        print(f"{QUANTILE_COL} {quantile}: " + ', '.join(
+            f"{cube.countries[i]} {cube.values[i, j, cube.metric_index['net gain']]:.0f}"
+            for i in np.argsort(ranks[:, j])))
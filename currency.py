@@ -0,0 +1,84 @@
+import json
+import threading
+import types
+from datastore import registry, DATA_PATH
+
+# Converts the amounts of a dataset from its local currency (price_unit in the
+# metadata) to a common reference unit, so countries can be compared:
+#   'EUR', 'GBP', 'USD': market exchange rates of the given year
+#   'PPP USD': international dollars, with the country's purchasing power parity
+# The tables in datasets/conversion.json are loaded once and indexed by
+# (currency, year), and by (country, year) for the PPPs. Converted datasets are
+# memoized per (dataset version, target unit, year).
+
+CONVERSION_FILE = DATA_PATH / 'conversion.json'
+DEFAULT_YEAR = 2020
+target_units = ['EUR', 'GBP', 'USD', 'PPP USD']
+# price_unit in the metadata -> ISO currency code
+currency_codes = {'Euro': 'EUR', 'EUR': 'EUR', 'GBP': 'GBP', 'USD': 'USD'}
+MONEY_COLUMNS = ['carbon payment', 'carbon revenue', 'net gain']
+
+_lock = threading.Lock()
+_tables = None
+_converted = {}  # (country, dataset version, target, year) -> (df, metadata, factor)
+
+
+def load_tables(path=CONVERSION_FILE):
+    # {'exchange_rates': {(currency, year): units per EUR}, 'ppp': {(country, year): units per USD}}
+    global _tables
+    with _lock:
+        if _tables is None:
+            with open(path, "r") as jsonfile:
+                raw = json.load(jsonfile)
+            _tables = {name: {(key, int(year)): float(rate)
+                              for key, rates in table['rates'].items() for year, rate in rates.items()}
+                       for name, table in raw.items()}
+        return _tables
+
+def lookup(table, key, year):
+    # the rate of the year, or of the nearest year in the table
+    if (key, year) in table:
+        return table[(key, year)]
+    years = [table_year for table_key, table_year in table if table_key == key]
+    if not years:
+        raise KeyError(f"no conversion rate for {key}")
+    return table[(key, min(years, key=lambda table_year: abs(table_year - year)))]
+
+def conversion_factor(country, price_unit, target, year=DEFAULT_YEAR):
+    # target units per unit of the local currency
+    tables = load_tables()
+    if target == 'PPP USD':
+        return 1 / lookup(tables['ppp'], country, year)
+    rates = tables['exchange_rates']
+    return lookup(rates, target, year) / lookup(rates, currency_codes.get(price_unit, price_unit), year)
+
+def conversion_factors(countries, target, year=DEFAULT_YEAR):
+    # one factor per country, to scale stacked multi-country arrays with factors[codes]
+    import numpy as np
+    return np.array([conversion_factor(country, registry.load_metadata(country)['price_unit'],
+                                       target, year) for country in countries])
+
+def converted_data(country, target, year=DEFAULT_YEAR):
+    """(df, metadata, factor) of a country with all amounts in the target unit.
+
+    The price in the metadata is converted too, tCO2 columns are unchanged.
+    Memoized per dataset version, the df is a shallow copy as in registry.load_data.
+    """
+    version = registry.version(country)
+    key = (country, version, target, year)
+    with _lock:
+        entry = _converted.get(key)
+    if entry is None:
+        meta_data = registry.load_metadata(country)
+        factor = conversion_factor(country, meta_data['price_unit'], target, year)
+        # a real copy: pandas may write column assignments into the shared, read-only arrays
+        df = registry.load_data(country).copy()
+        df[MONEY_COLUMNS] = df[MONEY_COLUMNS].to_numpy(dtype=float) * factor
+        meta_data = dict(meta_data, price=str(float(meta_data['price']) * factor), price_unit=target)
+        entry = (df, types.MappingProxyType(meta_data), factor)
+        with _lock:
+            for stale in [k for k in _converted if k[0] == country and k[1] != version]:
+                del _converted[stale]
+            _converted[key] = entry
+    df, meta_data, factor = entry
+    return df.copy(deep=False), meta_data, factor
@@ -0,0 +1,231 @@
+import io
+import os
+import json
+import hashlib
+import pathlib
+import threading
+import types
+
+DATA_PATH = pathlib.Path(r'datasets')
+RAWDATA_PATH = pathlib.Path(r'datasets/raw')
+# Arrow IPC files partitioned by country: store/country=<country>/part-0.arrow,
+# with the metadata JSON in the schema metadata
+STORE_PATH = DATA_PATH / 'store'
+STORE_METADATA_KEY = b'climate_income'
+# sha1 of the table as written (without this key), the dataset version: the
+# registry reads it from the file footer instead of hashing the whole file
+STORE_HASH_KEY = b'climate_income_sha1'
+# error estimates of the digitized datasets, written by process_rawdata.py
+ERRORS_FILE = DATA_PATH / 'errors.json'
+
+
+def store_file(country, store_path=STORE_PATH):
+    return pathlib.Path(store_path) / f'country={country}' / 'part-0.arrow'
+
+def write_store(df, country, metadata, store_path=STORE_PATH):
+    import pyarrow as pa
+    if df.index.name is not None:
+        df = df.reset_index()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[STORE_METADATA_KEY] = json.dumps(metadata).encode('utf-8')
+    write_store_table(table.replace_schema_metadata(schema_metadata), country, store_path)
+
+def table_hash(table):
+    import pyarrow as pa
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return hashlib.sha1(sink.getvalue()).hexdigest()
+
+def write_store_table(table, country, store_path=STORE_PATH):
+    import pyarrow as pa
+    schema_metadata = {key: value for key, value in (table.schema.metadata or {}).items()
+                       if key != STORE_HASH_KEY}
+    table = table.replace_schema_metadata(schema_metadata)
+    schema_metadata[STORE_HASH_KEY] = table_hash(table).encode('ascii')
+    table = table.replace_schema_metadata(schema_metadata)
+    path = store_file(country, store_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with pa.OSFile(str(tmp_path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    # atomic replace: readers keep a valid memory map of the previous file
+    os.replace(tmp_path, path)
+
+def read_store_file(path, columns=None):
+    # memory-mapped, zero-copy read; only the selected columns are ever paged in
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+    if columns is not None:
+        table = pa.Table.from_arrays([table.column(col) for col in columns], names=list(columns),
+                                     metadata=table.schema.metadata)
+    return table
+
+def store_hash(path):
+    # the writer's hash, from the schema in the file footer; the columns are not read
+    import pyarrow as pa
+    with pa.memory_map(str(path), 'r') as source:
+        schema_metadata = pa.ipc.open_file(source).schema.metadata or {}
+    digest = schema_metadata.get(STORE_HASH_KEY)
+    if digest is None:
+        # written before the hash was stored
+        return hashlib.sha1(path.read_bytes()).hexdigest()
+    return digest.decode('ascii')
+
+def table_metadata(table):
+    return json.loads(table.schema.metadata[STORE_METADATA_KEY].decode('utf-8'))
+
+def table_to_frame(table):
+    # numeric columns without nulls stay zero-copy views on the memory map
+    return table.to_pandas(split_blocks=True)
+
+
+# pandas and pyarrow are only imported once a file is actually parsed
+def load_errors(country, errors_file=ERRORS_FILE):
+    # error estimates of a country, None if there are none; without numpy or pandas,
+    # the app checks them on every run
+    try:
+        with open(errors_file, "r") as jsonfile:
+            return json.load(jsonfile).get(country)
+    except FileNotFoundError:
+        return None
+
+def _parse_csv(path, raw):
+    # round trip through Arrow: the columns become read-only arrays like those
+    # of the store, so the copy shared by all sessions cannot be written to
+    import pandas as pd
+    import pyarrow as pa
+    return table_to_frame(pa.Table.from_pandas(pd.read_csv(io.BytesIO(raw)), preserve_index=False))
+
+def _parse_json(path, raw):
+    return json.loads(raw.decode('utf-8'))
+
+def _parse_store(path, raw):
+    # the frame is converted from the table on first use, see load_data
+    table = read_store_file(path)
+    return {'table': table, 'metadata': table_metadata(table)}
+
+
+class DatasetRegistry:
+    """Process-wide cache of parsed dataset files, shared by all app sessions.
+
+    A file is parsed once. On later requests only its mtime/size is checked;
+    if those changed, the content hash decides whether it is parsed again.
+    For store files that is the hash the writer stored in the schema.
+    Data and metadata come from the Arrow store when a country has been
+    written to it, and from the CSV and JSON files otherwise.
+    """
+
+    def __init__(self, data_path=DATA_PATH, rawdata_path=RAWDATA_PATH, store_path=STORE_PATH):
+        self.data_path = pathlib.Path(data_path)
+        self.rawdata_path = pathlib.Path(rawdata_path)
+        self.store_path = pathlib.Path(store_path) if store_path is not None else None
+        self._lock = threading.Lock()
+        self._entries = {}  # path -> (stat signature, content hash, parsed object)
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _get(self, path, parser=None):
+        # without a parser only the content hash is brought up to date and
+        # parsing is deferred until the file is loaded
+        st = path.stat()
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            raw = None
+            if entry is None or entry[0] != signature:
+                if path.suffix == '.arrow':
+                    digest = store_hash(path)
+                else:
+                    raw = path.read_bytes()
+                    digest = hashlib.sha1(raw).hexdigest()
+                if entry is not None and entry[1] == digest:
+                    # touched but not modified: keep the parsed object
+                    entry = (signature, digest, entry[2])
+                else:
+                    if entry is not None:
+                        self.reloads += 1
+                    entry = (signature, digest, None)
+            if parser is not None and entry[2] is None:
+                # store files are memory-mapped by their parser, not read here
+                if raw is None and path.suffix != '.arrow':
+                    raw = path.read_bytes()
+                entry = (entry[0], entry[1], parser(path, raw))
+                self.misses += 1
+            elif parser is not None:
+                self.hits += 1
+            self._entries[path] = entry
+            return entry
+
+    def data_file(self, country):
+        return self.data_path / f'{country}.csv'
+
+    def metadata_file(self, country):
+        return self.rawdata_path / f'{country}.json'
+
+    def store_file(self, country):
+        if self.store_path is None:
+            return None
+        path = store_file(country, self.store_path)
+        return path if path.exists() else None
+
+    def load_data(self, country):
+        # shallow copy: column (re)assignment by the caller does not touch the
+        # cached frame; the underlying arrays are shared by all sessions and read-only
+        path = self.store_file(country)
+        if path is not None:
+            parsed = self._get(path, _parse_store)[2]
+            if 'frame' not in parsed:
+                parsed['frame'] = table_to_frame(parsed['table'])
+            df = parsed['frame']
+        else:
+            df = self._get(self.data_file(country), _parse_csv)[2]
+        return df.copy(deep=False)
+
+    def load_metadata(self, country):
+        path = self.store_file(country)
+        if path is not None:
+            metadata = self._get(path, _parse_store)[2]['metadata']
+        else:
+            metadata = self._get(self.metadata_file(country), _parse_json)[2]
+        return types.MappingProxyType(metadata)
+
+    def n_quantiles(self, country):
+        # the number of quantile bins (rows) of a country's data; store files need no pandas
+        path = self.store_file(country)
+        if path is not None:
+            return self._get(path, _parse_store)[2]['table'].num_rows
+        return len(self.load_data(country))
+
+    def countries(self):
+        # every country that can be loaded: with a store partition, or a data file and its metadata file
+        names = {path.stem for path in self.data_path.glob('*.csv') if self.metadata_file(path.stem).exists()}
+        if self.store_path is not None and self.store_path.exists():
+            names |= {path.name.split('=', 1)[1] for path in self.store_path.glob('country=*')}
+        return sorted(names)
+
+    def version(self, country):
+        # changes whenever the content of the data or metadata file changes
+        path = self.store_file(country)
+        if path is not None:
+            return self._get(path)[1][:12]
+        data_hash = self._get(self.data_file(country))[1]
+        meta_hash = self._get(self.metadata_file(country))[1]
+        return f'{data_hash[:12]}-{meta_hash[:12]}'
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'reloads': self.reloads,
+                    'files': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+registry = DatasetRegistry()
@@ -0,0 +1,151 @@
+import argparse
+import gzip
+import json
+from collections import Counter
+
+# The encoding stage between the plot builders and the browser. It compacts a
+# serialized figure without changing how it is drawn:
+# - annotation styling that every annotation sets, with the value most of them
+#   use, moves to layout.template.layout.annotationdefaults
+# - the template keeps only the trace defaults of the trace types in the figure,
+#   and no layout defaults of non-cartesian subplots (geo, polar, ...)
+# - annotation positions are rounded to SIGNIFICANT_DIGITS significant digits,
+#   numbers in the data and frames (shown on hover) to DATA_DIGITS, which only
+#   drops floating point noise like 674.1880000000001; the JSON has no whitespace
+# plotly 4.14 (and the plotly.js Streamlit 0.79 ships) has no typed-array
+# encoding for JSON figures, so arrays stay JSON lists of numbers.
+# The encoded JSON carries the size of the JSON it was encoded from, so the
+# sizes of every served figure are known (metrics.payload):
+#   python encoding.py                # payload sizes of the app's charts
+
+SIGNIFICANT_DIGITS = 4
+DATA_DIGITS = 12
+# annotation keys that are specific to each annotation, never moved to the defaults
+POSITION_KEYS = ['x', 'y', 'ax', 'ay', 'text']
+NON_CARTESIAN_LAYOUT = ['geo', 'mapbox', 'polar', 'ternary', 'scene']
+
+
+class EncodedJSON(str):
+    # figure JSON from the encoding stage, raw_bytes is the size before encoding
+    raw_bytes = None
+
+
+def dumps(fig):
+    return json.dumps(fig, separators=(',', ':'))
+
+def _round(value, digits=SIGNIFICANT_DIGITS):
+    if isinstance(value, float):
+        value = float(f'{value:.{digits}g}')
+        return int(value) if value.is_integer() and abs(value) < 2**53 else value
+    if isinstance(value, list):
+        return [_round(item, digits) for item in value]
+    if isinstance(value, dict):
+        return {key: _round(item, digits) for key, item in value.items()}
+    return value
+
+def shared_annotation_styling(annotations):
+    # {key: value} set by every annotation, with the value most of them use
+    if len(annotations) < 2:
+        return {}
+    keys = set(annotations[0]).intersection(*annotations[1:]) - set(POSITION_KEYS)
+    defaults = {}
+    for key in keys:
+        counts = Counter(json.dumps(annotation[key], sort_keys=True) for annotation in annotations)
+        value, count = counts.most_common(1)[0]
+        if count > 1:
+            defaults[key] = json.loads(value)
+    return defaults
+
+def encode_figure(fig, digits=SIGNIFICANT_DIGITS, data_digits=DATA_DIGITS):
+    """Compacted copy of a figure dict (as from json.loads(fig.to_json())).
+
+    Drawn the same as the original, up to the rounding of annotation positions;
+    data values keep every digit that can be displayed.
+    """
+    fig = dict(fig)
+    layout = dict(fig.get('layout', {}))
+    template = dict(layout.get('template', {}))
+    trace_types = {trace.get('type', 'scatter') for trace in fig.get('data', [])}
+    if 'data' in template:
+        template['data'] = {trace_type: defaults for trace_type, defaults in template['data'].items()
+                            if trace_type in trace_types}
+    if 'layout' in template and trace_types <= {'bar', 'scatter', 'scattergl'}:
+        template['layout'] = {key: value for key, value in template['layout'].items()
+                              if key not in NON_CARTESIAN_LAYOUT}
+
+    annotations = layout.get('annotations', [])
+    defaults = shared_annotation_styling(annotations)
+    if defaults:
+        template_layout = dict(template.get('layout', {}))
+        template_layout['annotationdefaults'] = dict(template_layout.get('annotationdefaults', {}), **defaults)
+        template['layout'] = template_layout
+        annotations = [{key: value for key, value in annotation.items()
+                        if key not in defaults or value != defaults[key]}
+                       for annotation in annotations]
+    if annotations:
+        layout['annotations'] = [dict(annotation, **{key: _round(annotation[key], digits)
+                                                     for key in POSITION_KEYS[:4] if key in annotation})
+                                 for annotation in annotations]
+    if template:
+        layout['template'] = template
+    fig['layout'] = layout
+    if 'data' in fig:
+        fig['data'] = _round(fig['data'], data_digits)
+    if 'frames' in fig:
+        fig['frames'] = _round(fig['frames'], data_digits)
+    return fig
+
+def encode_json(fig_json, digits=SIGNIFICANT_DIGITS, data_digits=DATA_DIGITS):
+    encoded = EncodedJSON(dumps(encode_figure(json.loads(fig_json), digits, data_digits)))
+    encoded.raw_bytes = len(fig_json.encode('utf-8'))
+    return encoded
+
+def payload_sizes(fig_json):
+    # bytes before and after encoding, raw and gzip compressed
+    encoded = encode_json(fig_json)
+    before, after = fig_json.encode('utf-8'), encoded.encode('utf-8')
+    return dict(before=len(before), after=len(after),
+                before_gzip=len(gzip.compress(before)), after_gzip=len(gzip.compress(after)))
+
+def report_figures(countries=None):
+    # (name, figure) of every chart of the app at the default size: the chart
+    # permutations, and per country a higher price, each currency, the
+    # uncertainty bands, the price trajectory and revenue recycling; and the comparison
+    from currency import target_units
+    from datastore import registry
+    from export_charts import permutations
+    import figures
+    countries = countries or figures.countries()
+    for options in permutations(countries):
+        if (options['width'], options['height']) != (800, 600):
+            continue  # the size does not change the payload
+        name = '/'.join([options['country'], options['quantiles'], options['orientation'], options['plot_type']])
+        yield name, figures.make_figure(options['country'], options['quantiles'],
+                                        figures.orientation_options[options['orientation']],
+                                        options['plot_type'])
+    for country in countries:
+        price = 2 * float(registry.load_metadata(country)['price'])
+        yield f'{country}/price {price:g}', figures.make_figure(country, price=price)
+        for unit in target_units:
+            yield f'{country}/{unit}', figures.make_figure(country, currency=unit)
+        if figures.has_error_estimates(country):
+            yield f'{country}/uncertainty', figures.make_figure(country, uncertainty=True)
+        yield f'{country}/trajectory', figures.trajectory_figure(country)
+        yield f'{country}/recycling', figures.recycling_figure(country)
+    yield 'comparison/' + ','.join(countries), figures.comparison_plot(countries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report figure payload sizes before and after encoding')
+    parser.add_argument('--countries', nargs='+', default=None)
+    args = parser.parse_args()
+    totals = Counter()
+    print(f"{'figure':<58} {'before':>8} {'after':>8} {'gzip before':>12} {'gzip after':>11}")
+    for name, fig in report_figures(args.countries):
+        sizes = payload_sizes(fig.to_json())
+        totals.update(sizes)
+        print(f"{name:<58} {sizes['before']:>8} {sizes['after']:>8} "
+              f"{sizes['before_gzip']:>12} {sizes['after_gzip']:>11}")
+    print(f"{'total':<58} {totals['before']:>8} {totals['after']:>8} "
+          f"{totals['before_gzip']:>12} {totals['after_gzip']:>11} "
+          f"({totals['after'] / totals['before']:.0%} of the raw size)")
@@ -0,0 +1,74 @@
+import argparse
+import itertools
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from figures import (countries, quantile_choices, orientation_options, plot_type_options,
+                     width_options, height_options, make_figure, figure_stem, input_mtime)
+
+# Renders every country x quantiles x orientation x plot type x size
+# combination to static files, without Streamlit:
+#   python export_charts.py --formats html json png --out exports
+
+EXPORT_PATH = pathlib.Path('exports')
+FORMATS = ['html', 'json', 'png']
+
+
+def permutations(selected_countries=None):
+    for country in selected_countries or countries():
+        for combination in itertools.product(quantile_choices(country), orientation_options, plot_type_options,
+                                             width_options, height_options):
+            yield dict(zip(['country', 'quantiles', 'orientation', 'plot_type', 'width', 'height'],
+                           (country,) + combination))
+
+def export_one(options, out_path, formats, force=False):
+    # returns the number of files written
+    stem = figure_stem(out_path, **options)
+    newer_than = input_mtime(options['country'])
+    todo = [fmt for fmt in formats if force or not stem.with_suffix(f'.{fmt}').exists()
+            or stem.with_suffix(f'.{fmt}').stat().st_mtime < newer_than]
+    if not todo:
+        return 0
+    stem.parent.mkdir(parents=True, exist_ok=True)
+    fig = make_figure(options['country'], options['quantiles'],
+                      orientation_options[options['orientation']], options['plot_type'],
+                      options['width'], options['height'])
+    for fmt in todo:
+        path = stem.with_suffix(f'.{fmt}')
+        if fmt == 'html':
+            fig.write_html(str(path), include_plotlyjs='cdn')
+        elif fmt == 'json':
+            fig.write_json(str(path))
+        else:
+            fig.write_image(str(path), width=options['width'], height=options['height'])
+    return len(todo)
+
+def export_all(out_path=EXPORT_PATH, formats=FORMATS, selected_countries=None, force=False, n_workers=None):
+    if 'png' in formats:
+        try:
+            import kaleido  # noqa: F401, needed by plotly for static images
+        except ImportError:
+            print("Warning. PNG export needs the kaleido package, skipping png")
+            formats = [fmt for fmt in formats if fmt != 'png']
+    options = list(permutations(selected_countries))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        written = list(pool.map(export_one, options, itertools.repeat(out_path),
+                                itertools.repeat(formats), itertools.repeat(force), chunksize=8))
+    elapsed = time.perf_counter() - start
+    rendered = sum(1 for n in written if n)
+    print(f"{len(options)} charts: {rendered} rendered, {len(options) - rendered} up to date, "
+          f"{sum(written)} files written to {out_path} in {elapsed:.1f} s "
+          f"({rendered / elapsed:.1f} charts/s, {sum(written) / elapsed:.1f} files/s)")
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export every chart permutation to static files')
+    parser.add_argument('--out', type=pathlib.Path, default=EXPORT_PATH)
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    parser.add_argument('--countries', nargs='+', default=None)
+    parser.add_argument('--force', action='store_true', help='also render up-to-date outputs')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    export_all(args.out, args.formats, args.countries, args.force, args.workers)
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+
+class FigureCache:
+    """Process-wide LRU cache of serialized figures (plotly JSON strings).
+
+    Entries are keyed on (country, dataset version, options). Storing a figure
+    for a new dataset version of a country drops the entries of older versions.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, max_entries=512):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _drop(self, key):
+        self.nbytes -= len(self._entries.pop(key))
+
+    def get(self, country, version, options):
+        key = (country, version, options)
+        with self._lock:
+            fig_json = self._entries.get(key)
+            if fig_json is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fig_json
+
+    def contains(self, country, version, options):
+        # without counting a hit or miss, or refreshing the entry
+        with self._lock:
+            return (country, version, options) in self._entries
+
+    def put(self, country, version, options, fig_json):
+        key = (country, version, options)
+        size = len(fig_json)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == country and k[1] != version]
+            for k in stale:
+                self._drop(k)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = fig_json
+            self.nbytes += size
+            while self.nbytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self.nbytes -= len(self._entries.popitem(last=False)[1])
+                self.evictions += 1
+
+    def get_or_build(self, country, version, options, build):
+        # build() returns the figure JSON; concurrent misses may both build,
+        # which is cheaper than holding the lock during the build
+        fig_json = self.get(country, version, options)
+        if fig_json is None:
+            fig_json = build()
+            self.put(country, version, options, fig_json)
+        return fig_json
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self.nbytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+figure_cache = FigureCache()
@@ -0,0 +1,330 @@
+import json
+import os
+import pathlib
+import threading
+from collections import OrderedDict
+from datastore import load_errors, registry
+from encoding import dumps, encode_json
+from figcache import figure_cache
+from metrics import payload, span
+
+# The app's figure pipeline without Streamlit: load -> scenario -> aggregate -> build.
+# Shared by the app, the batch export and the figure server.
+# numpy/pandas and plotly are imported in the functions that need them, so a
+# figure served from the cache or from the prebuilt files never imports plotly.
+#
+# The pipeline runs in stages, each cached on its own inputs only (see
+# STAGE_INPUTS): the data stage (chart_data), the figure stage (the serialized
+# figure at BASE_LAYOUT, in the figure cache) and the layout stage, which
+# patches size and quantile order into a copy of the cached figure. Changing
+# only the width, height or ordering therefore never rebuilds the figure.
+# Cached figures are compacted by the encoding stage (encoding.py).
+
+DEFAULT_COUNTRY = 'uk'
+quantile_options = ['deciles', 'quintiles', 'percentiles']
+# bins per quantile option: data with more bins is averaged down to them, data with fewer keeps its own
+QUANTILE_BINS = {'deciles': 10, 'quintiles': 5, 'percentiles': 100}
+orientation_options = {'horizontal': 'h', 'vertical': 'v'}
+plot_type_options = ['bars', 'bars and line', 'lines and delta']
+width_options = [600, 800, 1000]
+height_options = [500, 600, 1000]
+
+# figure JSON rendered at build time by: python export_charts.py --formats json --out prebuilt
+PREBUILT_PATH = pathlib.Path('prebuilt')
+CODE_FILES = ['plots.py', 'figures.py', 'scenarios.py']
+
+STAGE_INPUTS = {'data': ['country', 'quantiles', 'price', 'currency'],
+                'figure': ['country', 'quantiles', 'price', 'currency',
+                           'orientation', 'plot_type', 'payment_negative', 'uncertainty'],
+                'layout': ['orientation', 'width', 'height', 'reverse']}
+BASE_LAYOUT = dict(width=800, height=600, reverse=False)
+DATA_STAGE_ENTRIES = 64
+# carbon prices range from 0 to this many times the metadata price, as on the app's slider
+MAX_PRICE_FACTOR = 5
+
+_data_lock = threading.Lock()
+_data_stage = OrderedDict()  # (country, dataset version, quantiles, price, currency) -> df
+
+
+def price_step(base_price):
+    # the app's price slider: whole units for whole metadata prices, else tenths (e.g. a price of 12.5)
+    return 1. if base_price.is_integer() else .1
+
+def slider_price(price, base_price):
+    # the nearest price on the app's price slider
+    step = price_step(base_price)
+    return round(round(price / step) * step, 1)
+
+def countries():
+    # every country of the registry, also those added by microdata.py or a new parser
+    return registry.countries()
+
+def default_country_index(options):
+    return options.index(DEFAULT_COUNTRY) if DEFAULT_COUNTRY in options else 0
+
+def change_to_quantiles(df, n_quantiles):
+    # averages consecutive bins into n_quantiles groups of (nearly) equal size, for any number of bins
+    import numpy as np
+    df = df.groupby(np.arange(len(df)) * n_quantiles // len(df)).mean()
+    df['income decile'] = np.arange(1, n_quantiles + 1)
+    return df
+
+def quantile_choices(country):
+    # the quantile options of a country, those its data has the bins for
+    n_bins = registry.n_quantiles(country)
+    return [quantiles for quantiles in quantile_options if QUANTILE_BINS[quantiles] <= n_bins] \
+        or quantile_options[:1]
+
+def dataset(country, currency=None):
+    # (df, metadata, factor): in the local currency (factor 1), or converted to a reference unit
+    if currency is None:
+        return registry.load_data(country), registry.load_metadata(country), 1.
+    from currency import converted_data
+    return converted_data(country, currency)
+
+def chart_data(country, quantiles='deciles', price=None, currency=None):
+    # the data stage, price in the local currency like the metadata price;
+    # the df is shared with the stage cache, callers must not write to its arrays
+    key = (country, registry.version(country), quantiles, price, currency)
+    with _data_lock:
+        df = _data_stage.get(key)
+        if df is not None:
+            _data_stage.move_to_end(key)
+            return df.copy(deep=False)
+    df = _chart_data(country, quantiles, price, currency)
+    with _data_lock:
+        _data_stage[key] = df
+        while len(_data_stage) > DATA_STAGE_ENTRIES:
+            _data_stage.popitem(last=False)
+    return df.copy(deep=False)
+
+def _chart_data(country, quantiles, price, currency):
+    with span('load'):
+        df, meta_data, factor = dataset(country, currency)
+    with span('aggregate'):
+        if price is not None and price * factor != float(meta_data['price']):
+            from scenarios import scenario_frame
+            df = scenario_frame(df, meta_data, price * factor)
+        if len(df) > QUANTILE_BINS[quantiles]:
+            df = change_to_quantiles(df, QUANTILE_BINS[quantiles])
+    return df
+
+def has_error_estimates(country):
+    return bool(load_errors(country))
+
+def net_gain_error_bands(country, df, quantiles='deciles', price=None, currency=None):
+    # None if there are no error estimates for the country
+    import numpy as np
+    from uncertainty import cached_net_gain_bands
+    errors = load_errors(country)
+    if not errors:
+        return None
+    base_price = float(registry.load_metadata(country)['price'])
+    price = base_price if price is None else price
+    # the errors scale with the price, and average out over the deciles in a quintile
+    std = errors['std_error'] * price / base_price * np.sqrt(10 / len(df))
+    if currency is not None:
+        std *= dataset(country, currency)[2]
+    lower, _, upper = cached_net_gain_bands(df, std)
+    return {'net gain': (lower, upper)}
+
+def warm_up_error_bands():
+    # samples the unit-std bands of every quantile mode once, at start-up, so that
+    # requests only scale cached bands (see uncertainty.cached_net_gain_bands)
+    for country in countries():
+        if has_error_estimates(country):
+            for quantiles in quantile_choices(country):
+                net_gain_error_bands(country, chart_data(country, quantiles), quantiles)
+
+def make_figure(country, quantiles='deciles', orientation='h', plot_type='bars and line',
+                width=800, height=600, reverse=False, payment_negative=False,
+                price=None, uncertainty=False, currency=None):
+    from plots import plot_builders
+    df = chart_data(country, quantiles, price, currency)
+    meta_data = dataset(country, currency)[1]
+    error_bands = None
+    if uncertainty:
+        with span('aggregate'):
+            error_bands = net_gain_error_bands(country, df, quantiles, price, currency)
+    make_plot = plot_builders[plot_type]
+    with span('build'):
+        return make_plot(df, meta_data, orientation=orientation,
+                         payment_negative=payment_negative, error_bands=error_bands, country=country,
+                         reverse=reverse, width=width, height=height)
+
+def trajectory_figure(country, quantiles='deciles', orientation='h', payment_negative=False, price=None,
+                      increase=10., n_years=10, currency=None):
+    # animated bar chart along a price rising by `increase` per year, starting at `price`
+    # (the metadata price if None), with one frame per year; prices in the local currency
+    from plots import make_trajectory_plot
+    from scenarios import price_trajectory, sweep
+    price = float(registry.load_metadata(country)['price']) if price is None else float(price)
+    df = chart_data(country, quantiles, currency=currency)
+    _, meta_data, factor = dataset(country, currency)
+    prices = price_trajectory(price * factor, increase * factor, n_years)
+    with span('aggregate'):
+        results = sweep(df, meta_data, prices)
+    labels = [f"Year {year}: {p:.0f} {meta_data['price_unit']}/tCO2"
+              for year, p in enumerate(prices)]
+    with span('build'):
+        return make_trajectory_plot(df, meta_data, results, labels, orientation=orientation,
+                                    payment_negative=payment_negative, country=country, **BASE_LAYOUT)
+
+def trajectory_json(country, quantiles='deciles', orientation='h', width=800, height=600,
+                    reverse=False, payment_negative=False, price=None, increase=10., n_years=10,
+                    currency=None):
+    # the trajectory figure, cached at BASE_LAYOUT
+    price = float(registry.load_metadata(country)['price']) if price is None else float(price)
+    options = dict(BASE_LAYOUT, mode='trajectory', quantiles=quantiles, orientation=orientation,
+                   payment_negative=payment_negative, price=price, increase=float(increase),
+                   n_years=n_years, currency=currency)
+
+    def build():
+        fig = trajectory_figure(country, quantiles, orientation, payment_negative, price, increase, n_years,
+                                currency)
+        with span('serialize'):
+            fig_json = fig.to_json()
+        with span('encode'):
+            return encode_json(fig_json)
+    fig_json = payload(figure_cache.get_or_build(country, registry.version(country),
+                                                 tuple(sorted(options.items())), build))
+    if dict(width=width, height=height, reverse=reverse) == BASE_LAYOUT:
+        return fig_json
+    return dumps(patch_layout(json.loads(fig_json), orientation, width, height, reverse))
+
+def figure_stem(out_path, country, quantiles, orientation, plot_type, width, height):
+    # orientation as in the sidebar ('horizontal' or 'vertical')
+    name = '-'.join([quantiles, orientation, plot_type.replace(' ', '-'), f'{width}x{height}'])
+    return pathlib.Path(out_path) / country / name
+
+def input_mtime(country):
+    # newest of the dataset files and the plotting code a figure depends on
+    store_file = registry.store_file(country)
+    files = [store_file] if store_file is not None else \
+        [registry.data_file(country), registry.metadata_file(country)]
+    files += [pathlib.Path(__file__).parent / name for name in CODE_FILES]
+    return max(os.stat(path).st_mtime for path in files)
+
+def prebuilt_json(country, options, prebuilt_path=PREBUILT_PATH):
+    # the prebuilt figure for these options if there is an up-to-date one, else None
+    if options['reverse'] or options['payment_negative'] or options['uncertainty'] \
+            or options['price'] is not None or options['currency'] is not None:
+        return None
+    orientation = {code: name for name, code in orientation_options.items()}[options['orientation']]
+    path = figure_stem(prebuilt_path, country, options['quantiles'], orientation,
+                       options['plot_type'], options['width'], options['height']).with_suffix('.json')
+    try:
+        if path.stat().st_mtime < input_mtime(country):
+            return None
+        return path.read_text()
+    except FileNotFoundError:
+        return None
+
+def patch_layout(fig, orientation='h', width=800, height=600, reverse=False):
+    # the layout stage: size and quantile ordering, applied in place to a figure dict
+    # exactly as build_figure would have set them
+    layout = fig['layout']
+    layout['width'], layout['height'] = width, height
+    quantile_axis = layout.setdefault('yaxis' if orientation == 'h' else 'xaxis', {})
+    if reverse:
+        quantile_axis['autorange'] = 'reversed'
+    else:
+        quantile_axis.pop('autorange', None)
+    return fig
+
+def base_figure_json(country, quantiles='deciles', orientation='h', plot_type='bars and line',
+                     payment_negative=False, price=None, uncertainty=False, currency=None):
+    # the figure stage: serialized figure at BASE_LAYOUT, from the figure cache,
+    # the prebuilt files or a fresh build
+    options = figure_stage_options(country, quantiles, orientation, plot_type, payment_negative,
+                                   price, uncertainty, currency)
+
+    def build():
+        with span('load'):
+            fig_json = prebuilt_json(country, options)
+        if fig_json is None:
+            fig = make_figure(country, **options)
+            with span('serialize'):
+                fig_json = fig.to_json()
+        with span('encode'):
+            return encode_json(fig_json)
+    return figure_cache.get_or_build(country, registry.version(country),
+                                     tuple(sorted(options.items())), build)
+
+def figure_stage_options(country, quantiles='deciles', orientation='h', plot_type='bars and line',
+                         payment_negative=False, price=None, uncertainty=False, currency=None):
+    # the inputs of the figure stage, as a dict; the metadata price is the default price
+    if price is not None and price == float(registry.load_metadata(country)['price']):
+        price = None
+    return dict(BASE_LAYOUT, quantiles=quantiles, orientation=orientation, plot_type=plot_type,
+                payment_negative=payment_negative, price=price, uncertainty=uncertainty,
+                currency=currency)
+
+def figure_cached(country, **options):
+    # whether the figure stage of these (sidebar) options is in the figure cache
+    stage_options = figure_stage_options(country, **{name: value for name, value in options.items()
+                                                     if name in STAGE_INPUTS['figure']})
+    return figure_cache.contains(country, registry.version(country),
+                                 tuple(sorted(stage_options.items())))
+
+def figure_dict(country, quantiles='deciles', orientation='h', plot_type='bars and line',
+                width=800, height=600, reverse=False, payment_negative=False,
+                price=None, uncertainty=False, currency=None):
+    # the figure as a dict for st.plotly_chart, layout options patched in
+    fig = json.loads(payload(base_figure_json(country, quantiles, orientation, plot_type, payment_negative,
+                                              price, uncertainty, currency)))
+    return patch_layout(fig, orientation, width, height, reverse)
+
+def figure_json(country, quantiles='deciles', orientation='h', plot_type='bars and line',
+                width=800, height=600, reverse=False, payment_negative=False,
+                price=None, uncertainty=False, currency=None):
+    # serialized figure, patched only when the layout options differ from BASE_LAYOUT
+    fig_json = payload(base_figure_json(country, quantiles, orientation, plot_type, payment_negative,
+                                        price, uncertainty, currency))
+    if dict(width=width, height=height, reverse=reverse) == BASE_LAYOUT:
+        return fig_json
+    return dumps(patch_layout(json.loads(fig_json), orientation, width, height, reverse))
+
+def comparison_plot(countries, quantiles='deciles', width=1000, currency=None):
+    # small-multiples figure of several countries, amounts relative to the
+    # average payment, or in the currency unit if one is given
+    from comparison import comparison_arrays, comparison_figure
+    arrays = comparison_arrays(countries, quantiles, currency=currency)
+    with span('build'):
+        return comparison_figure(arrays, width)
+
+def comparison_json(countries, quantiles='deciles', width=1000, currency=None):
+    # the comparison figure, cached on the dataset versions of all its countries
+    def build():
+        fig = comparison_plot(countries, quantiles, width, currency)
+        with span('serialize'):
+            fig_json = fig.to_json()
+        with span('encode'):
+            return encode_json(fig_json)
+    countries = tuple(countries)
+    versions = tuple(registry.version(country) for country in countries)
+    return payload(figure_cache.get_or_build(countries, versions,
+                                             (('currency', currency), ('quantiles', quantiles), ('width', width)),
+                                             build))
+
+def recycling_figure(country, quantiles='deciles', price=None, currency=None, width=800, height=600):
+    # Pareto fronts of budget-neutral recycling schemes for the payments of the data stage
+    from recycling import recycling_fronts, make_recycling_figure
+    df = chart_data(country, quantiles, price, currency)
+    with span('aggregate'):
+        fronts = recycling_fronts(df['carbon payment'].to_numpy(dtype=float))
+    with span('build'):
+        return make_recycling_figure(fronts, dataset(country, currency)[1]['price_unit'], country,
+                                     quantiles, width, height)
+
+def recycling_json(country, quantiles='deciles', price=None, currency=None, width=800, height=600):
+    # the recycling figure, cached like the figure stage
+    def build():
+        fig = recycling_figure(country, quantiles, price, currency, width, height)
+        with span('serialize'):
+            fig_json = fig.to_json()
+        with span('encode'):
+            return encode_json(fig_json)
+    options = (('currency', currency), ('height', height), ('mode', 'recycling'), ('price', price),
+               ('quantiles', quantiles), ('width', width))
+    return payload(figure_cache.get_or_build(country, registry.version(country), options, build))
@@ -0,0 +1,255 @@
+import argparse
+import io
+import json
+import os
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from datastore import DATA_PATH, registry
+
+# Carbon payment, dividend (carbon revenue) and net gain of single households,
+# from their yearly spend on domestic energy, transport and food:
+#   household({'energy': 1800, 'transport': 2500, 'food': 4000}, 'uk', price=60)
+# and of whole customer files, streamed in chunks and scored in parallel:
+#   python household.py customers.csv --out scored.parquet --price 60 --workers 4
+# Input files have one row per household with the columns of input_columns;
+# the output has the input columns plus those of the scored results.
+#
+# The carbon intensities (tCO2 per unit of currency spent) per category are
+# implied by the dataset (UK only): the average tCO2 of a household in the
+# category (payment / metadata price, averaged over the quantiles, which hold
+# equal numbers of households) over the average household spend on it, from
+# SPEND_FILE: {country: {'weekly_spend': {input column: amount}, 'price_unit': ..., 'source': citation}}.
+# Other emission factors can be passed as intensities. The dividend per
+# household is the dataset's carbon revenue, scaled with the price.
+
+CATEGORIES = ['Domestic Housing and Energy', 'Transport', 'Food']
+# input column (yearly spend) per category
+input_columns = {'Domestic Housing and Energy': 'energy', 'Transport': 'transport', 'Food': 'food'}
+SPEND_FILE = DATA_PATH / 'household_spend.json'
+WEEKS_PER_YEAR = 52
+CHUNK_BYTES = 64 * 2**20
+WORKERS = os.cpu_count() or 1
+# median yearly spends of the synthetic households, only for benchmarks
+SYNTHETIC_SPEND = {'energy': 1500., 'transport': 2500., 'food': 4000.}
+
+
+def load_spend(country, spend_file=SPEND_FILE):
+    # the household spend entry of a country, None if there is none
+    try:
+        with open(spend_file, "r") as jsonfile:
+            return json.load(jsonfile).get(country)
+    except FileNotFoundError:
+        return None
+
+def average_spend(country):
+    # {input column: yearly spend} of the average household, None if unknown
+    entry = load_spend(country)
+    if entry is None:
+        return None
+    return {column: WEEKS_PER_YEAR * amount for column, amount in entry['weekly_spend'].items()}
+
+def implied_intensities(country):
+    # {input column: tCO2 per unit of currency}, see the top of the file; None without
+    # per-category payments or an average spend for the country
+    spend, meta_data = average_spend(country), registry.load_metadata(country)
+    df = registry.load_data(country)
+    if spend is None or not all(category in df.columns for category in CATEGORIES):
+        return None
+    if load_spend(country)['price_unit'] != meta_data['price_unit']:
+        raise ValueError(f"the average spend of {country} is not in {meta_data['price_unit']}")
+    tco2 = df[CATEGORIES].mean() / float(meta_data['price'])
+    return {input_columns[category]: float(tco2[category] / spend[input_columns[category]])
+            for category in CATEGORIES}
+
+def household_parameters(country='uk', price=None, intensities=None):
+    """Intensities, price and dividend per household, at the price (metadata price if None).
+
+    intensities ({input column: tCO2 per unit of currency}) default to the
+    implied ones. The dividend scales with the price, as in the scenarios
+    with a fixed dividend share.
+    """
+    intensities = implied_intensities(country) if intensities is None else intensities
+    if intensities is None:
+        raise ValueError(f"{country} has no per-category payments ({CATEGORIES}) or no average spend "
+                         f"in {SPEND_FILE}: pass intensities "
+                         f"{{{', '.join(input_columns.values())}: tCO2 per unit of currency}}")
+    missing = [col for col in input_columns.values() if col not in intensities]
+    if missing:
+        raise ValueError(f"emission factors of {country} have no {missing}")
+    df, meta_data = registry.load_data(country), registry.load_metadata(country)
+    base_price = float(meta_data['price'])
+    price = base_price if price is None else float(price)
+    return dict(intensities=np.array([float(intensities[input_columns[category]]) for category in CATEGORIES]),
+                price=price, dividend=df['carbon revenue'].mean() * price / base_price,
+                price_unit=meta_data['price_unit'])
+
+def score(spend, params):
+    # spend: (n_households, len(CATEGORIES)) array -> {result column: (n_households,) array}
+    tco2 = np.asarray(spend, dtype=float) @ params['intensities']
+    payment = params['price'] * tco2
+    dividend = np.full(len(payment), params['dividend'])
+    return {'tCO2': tco2, 'carbon payment': payment, 'carbon revenue': dividend,
+            'net gain': dividend - payment}
+
+def household(spend, country='uk', price=None, intensities=None):
+    """Results of one household, spend as {input column: yearly spend}.
+
+    Includes the payment per category, like a row of datasets/<country>.csv.
+    """
+    params = household_parameters(country, price, intensities)
+    amounts = np.array([float(spend.get(input_columns[category], 0)) for category in CATEGORIES])
+    result = {name: float(values[0]) for name, values in score(amounts[None, :], params).items()}
+    result.update({category: float(params['price'] * intensity * amount)
+                   for category, intensity, amount in zip(CATEGORIES, params['intensities'], amounts)})
+    return result
+
+
+def csv_chunks(path, chunk_bytes=CHUNK_BYTES):
+    # [(start, end)] byte ranges of about chunk_bytes, at line boundaries, after the header
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        start = f.tell()
+        ranges = []
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def file_tasks(path, chunk_bytes=CHUNK_BYTES):
+    # (column names, [task]); a task is what one worker reads and scores
+    path = str(path)
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        names = parquet_file.schema_arrow.names
+        return names, [('parquet', path, i, names) for i in range(parquet_file.num_row_groups)]
+    names = list(pd.read_csv(path, nrows=0).columns)
+    return names, [('csv', path, chunk, names) for chunk in csv_chunks(path, chunk_bytes)]
+
+def read_task(task):
+    kind, path, part, names = task
+    if kind == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).read_row_group(part).to_pandas()
+    start, end = part
+    with open(path, 'rb') as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    return pd.read_csv(io.BytesIO(raw), header=None, names=names)
+
+def score_task(task, params):
+    # runs in the worker processes
+    df = read_task(task)
+    spend = np.column_stack([df[input_columns[category]].to_numpy(dtype=float)
+                             for category in CATEGORIES])
+    for col, values in score(np.nan_to_num(spend), params).items():
+        df[col] = values
+    return df
+
+def scored_chunks(path, params, workers=WORKERS, chunk_bytes=CHUNK_BYTES):
+    # scored DataFrames in file order; at most 2 chunks per worker are in memory
+    names, tasks = file_tasks(path, chunk_bytes)
+    missing = [col for col in input_columns.values() if col not in names]
+    if missing:
+        raise ValueError(f"{path} has no column(s) {missing}")
+    if workers <= 1:
+        for task in tasks:
+            yield score_task(task, params)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for task in tasks:
+            pending.append(pool.submit(score_task, task, params))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def score_file(path, out_path=None, country='uk', price=None, workers=WORKERS, chunk_bytes=CHUNK_BYTES,
+               intensities=None):
+    """Scores every household of a CSV or Parquet file, written to out_path (CSV or Parquet).
+
+    Returns a summary: households, seconds, households per second, mean net gain
+    and the share of households with a positive net gain.
+    """
+    params = household_parameters(country, price, intensities)
+    start = time.perf_counter()
+    n_households, net_gain_sum, winners = 0, 0., 0
+    writer = None
+    out_path = pathlib.Path(out_path) if out_path is not None else None
+    try:
+        for i, df in enumerate(scored_chunks(path, params, workers, chunk_bytes)):
+            net_gain = df['net gain'].to_numpy()
+            n_households += len(df)
+            net_gain_sum += net_gain.sum()
+            winners += int((net_gain > 0).sum())
+            if out_path is None:
+                continue
+            if out_path.suffix == '.parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(str(out_path), table.schema)
+                writer.write_table(table)
+            else:
+                df.to_csv(out_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    finally:
+        if writer is not None:
+            writer.close()
+    seconds = time.perf_counter() - start
+    return {'households': n_households,
+            'seconds': seconds,
+            'households_per_second': n_households / seconds if seconds else 0.,
+            'mean_net_gain': net_gain_sum / n_households if n_households else 0.,
+            'winner_share': winners / n_households if n_households else 0.,
+            'price': params['price'],
+            'price_unit': params['price_unit']}
+
+def synthetic_households(n_households, seed=0):
+    # lognormal spends around SYNTHETIC_SPEND, for benchmarks
+    rng = np.random.default_rng(seed)
+    spend = np.array([SYNTHETIC_SPEND[input_columns[category]] for category in CATEGORIES])
+    spend = spend * rng.lognormal(0, 0.5, size=(n_households, len(CATEGORIES)))
+    df = pd.DataFrame(spend.round(2), columns=[input_columns[category] for category in CATEGORIES])
+    df.insert(0, 'household', np.arange(n_households))
+    return df
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score households from their yearly spend per category')
+    parser.add_argument('path', help=f"CSV or Parquet file with the columns {list(input_columns.values())}")
+    parser.add_argument('--out', default=None, help='CSV or Parquet file for the scored households')
+    parser.add_argument('--country', default='uk')
+    parser.add_argument('--price', type=float, default=None, help='carbon price, the metadata price if not given')
+    for column in input_columns.values():
+        parser.add_argument(f'--{column}-intensity', type=float, default=None,
+                            help=f'tCO2 per currency unit of {column} spend (default: implied by the dataset)')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / 2**20)
+    parser.add_argument('--synthetic', type=int, default=None,
+                        help='first write this many synthetic households to path')
+    args = parser.parse_args()
+    intensities = {column: getattr(args, f'{column}_intensity') for column in input_columns.values()}
+    if all(value is None for value in intensities.values()):
+        intensities = None
+    elif any(value is None for value in intensities.values()):
+        parser.error('give the intensity of every category, or none')
+    if args.synthetic:
+        df = synthetic_households(args.synthetic)
+        if args.path.endswith('.parquet'):
+            df.to_parquet(args.path, index=False, row_group_size=1_000_000)
+        else:
+            df.to_csv(args.path, index=False)
+    summary = score_file(args.path, args.out, args.country, args.price, args.workers,
+                         int(args.chunk_mb * 2**20), intensities)
+    print(f"{summary['households']} households in {summary['seconds']:.2f} s "
+          f"({summary['households_per_second']:,.0f}/s), price {summary['price']:g} "
+          f"{summary['price_unit']}/tCO2: mean net gain {summary['mean_net_gain']:.2f} "
+          f"{summary['price_unit']}, {summary['winner_share']:.0%} gain")
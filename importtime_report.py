@@ -0,0 +1,48 @@
+import argparse
+import subprocess
+import sys
+
+# Import-time budget report, based on python -X importtime:
+#   python importtime_report.py                   # the app and its figure pipeline
+#   python importtime_report.py plots --budget 0.3
+# Exits with status 1 when a module takes longer than the budget (in seconds).
+
+DEFAULT_MODULES = ['climateincome_app', 'figures', 'datastore', 'plots']
+BUDGET = 1.0
+
+
+def import_times(module):
+    # {imported module: (self seconds, cumulative seconds)} for a fresh interpreter
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ImportError(f"importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return times
+
+def report(module, budget=BUDGET, top=10):
+    times = import_times(module)
+    total = times[module][1]
+    status = 'OK' if total <= budget else 'OVER BUDGET'
+    print(f"{module}: {total:.3f} s (budget {budget:.3f} s) {status}")
+    # top-level packages are the ones that matter for lazy-import decisions
+    packages = {name: cumulative for name, (_, cumulative) in times.items()
+                if '.' not in name and name != module}
+    for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"    {cumulative:8.3f} s  {name}")
+    return total <= budget
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report import times against a budget')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--budget', type=float, default=BUDGET, help='seconds per module')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    within_budget = [report(module, args.budget, args.top) for module in args.modules]
+    sys.exit(0 if all(within_budget) else 1)
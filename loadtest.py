@@ -0,0 +1,138 @@
+import argparse
+import random
+import resource
+import threading
+import time
+import numpy as np
+import figures
+from datastore import registry
+from figcache import figure_cache
+from prefetch import prefetcher
+
+# Simulated concurrent app sessions, in-process: every session is a thread that
+# changes one random sidebar option per interaction and asks the figure
+# pipeline for the figure, like a Streamlit rerun does.
+#   python loadtest.py --sessions 1 10 50 --interactions 20
+# Reports p50/p95/p99 latency per interaction and the RSS growth per session.
+# With --prefetch the sessions prefetch their next views in the background
+# (prefetch.py) and the prefetch hit rate is reported.
+
+SESSION_COUNTS = [1, 10, 50]
+INTERACTIONS = 20
+THINK_TIME = 0.
+# price slider positions, relative to the country's base price
+PRICE_FACTORS = [0.5, 1, 1.5, 2, 3]
+
+sidebar_space = {'country': figures.countries(),
+                 'quantiles': figures.quantile_options,
+                 'orientation': list(figures.orientation_options.values()),
+                 'plot_type': figures.plot_type_options,
+                 'width': figures.width_options,
+                 'height': figures.height_options,
+                 'reverse': [False, True],
+                 'payment_negative': [False, True],
+                 'price_factor': PRICE_FACTORS,
+                 'uncertainty': [False, True],
+                 'currency': [None, 'EUR', 'GBP', 'USD', 'PPP USD']}
+default_options = dict(country='uk', quantiles='quintiles', orientation='h', plot_type='bars and line',
+                       width=800, height=600, reverse=False, payment_negative=False, price_factor=1,
+                       uncertainty=False, currency=None)
+
+
+def rss_bytes():
+    # current resident set size; the peak where /proc is not available
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def figure_options(sidebar):
+    options = dict(sidebar)
+    base_price = float(registry.load_metadata(options['country'])['price'])
+    options['price'] = base_price * options.pop('price_factor')
+    return options
+
+def session(seed, n_interactions, latencies, think_time=THINK_TIME, prefetch=False):
+    # one simulated user; returns the last figure, which its session holds on to
+    rng = random.Random(seed)
+    sidebar = dict(default_options)
+    fig = None
+    for _ in range(n_interactions):
+        name = rng.choice(list(sidebar_space))
+        sidebar[name] = rng.choice(sidebar_space[name])
+        options = figure_options(sidebar)
+        start = time.perf_counter()
+        if prefetch:
+            prefetcher.served(options)
+        fig = figures.figure_dict(**options)
+        latencies.append(time.perf_counter() - start)
+        if prefetch:
+            prefetcher.prefetch_next(options)
+        if think_time:
+            time.sleep(think_time)
+    return fig
+
+def run(n_sessions, n_interactions=INTERACTIONS, think_time=THINK_TIME, seed=0, prefetch=False):
+    latencies = []
+    figs = [None] * n_sessions
+
+    def target(i):
+        figs[i] = session(seed + i, n_interactions, latencies, think_time, prefetch)
+
+    rss_before = rss_bytes()
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n_sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    rss_after = rss_bytes()
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return dict(sessions=n_sessions, requests=len(latencies), throughput=len(latencies) / elapsed,
+                p50=p50, p95=p95, p99=p99, rss=rss_after,
+                rss_per_session=(rss_after - rss_before) / n_sessions)
+
+def shared_data_check():
+    # every session must see the same read-only arrays of a country, not a copy each
+    frames = {}
+    threads = [threading.Thread(target=lambda i=i: frames.__setitem__(i, registry.load_data('uk')))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    arrays = [frame['net gain'].to_numpy() for frame in frames.values()]
+    shared = all(np.shares_memory(arrays[0], other) for other in arrays[1:])
+    read_only = not any(array.flags.writeable for array in arrays)
+    return shared, read_only
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the figure pipeline with simulated sessions')
+    parser.add_argument('--sessions', type=int, nargs='+', default=SESSION_COUNTS)
+    parser.add_argument('--interactions', type=int, default=INTERACTIONS)
+    parser.add_argument('--think-time', type=float, default=THINK_TIME, help='seconds between interactions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefetch', action='store_true', help='prefetch the next views in the background')
+    args = parser.parse_args()
+    if args.prefetch:
+        prefetcher.start()
+
+    # imports and dataset loading are one-off costs, keep them out of the first run
+    figures.figure_dict(**figure_options(default_options))
+    shared, read_only = shared_data_check()
+    print(f"dataset arrays shared between sessions: {shared}, read-only: {read_only}")
+    print(f"{'sessions':>8} {'requests':>8} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'RSS (MB)':>9} {'RSS/session (kB)':>17}")
+    for n_sessions in args.sessions:
+        # every run starts without cached figures, the datasets stay loaded
+        figure_cache.clear()
+        result = run(n_sessions, args.interactions, args.think_time, args.seed, args.prefetch)
+        print(f"{result['sessions']:>8} {result['requests']:>8} {result['throughput']:>8.1f} "
+              f"{1e3 * result['p50']:>9.1f} {1e3 * result['p95']:>9.1f} {1e3 * result['p99']:>9.1f} "
+              f"{result['rss'] / 2**20:>9.1f} {result['rss_per_session'] / 1024:>17.1f}")
+    print(f"figure cache: {figure_cache.stats()}")
+    if args.prefetch:
+        print(f"prefetch: {prefetcher.stats()}")
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datastore import registry
+from figcache import figure_cache
+
+try:
+    from prometheus_client import Histogram, start_http_server
+    from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+except ImportError:
+    Histogram = None
+
+# Named timing spans for the figure pipeline: load -> aggregate -> build ->
+# serialize -> encode -> render. Every span is observed in a Prometheus histogram
+# (when prometheus-client is installed) and kept per thread, so the app can
+# show the spans of the current run in its debug panel. Spans are labelled with
+# the source of the work, SOURCES[0] unless the thread set another (prefetch):
+#   with span('load'):
+#       df = registry.load_data(country)
+# The JSON size of every served figure, before and after the encoding stage,
+# is observed the same way (payload()).
+# The metrics, including the dataset registry, figure cache and prefetch counters, are
+# served on http://localhost:<METRICS_PORT>/metrics once start_metrics_server()
+# has been called.
+
+STAGES = ['load', 'aggregate', 'build', 'serialize', 'encode', 'render']
+SOURCES = ['user', 'prefetch']
+METRICS_PORT = int(os.environ.get('CLIMATEINCOME_METRICS_PORT', 9108))
+DEBUG = os.environ.get('CLIMATEINCOME_DEBUG', '').lower() in ('1', 'true', 'yes')
+# spans are mostly in the 1 ms - 1 s range
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+PAYLOAD_BUCKETS = tuple(2**k for k in range(10, 24))  # 1 KB - 8 MB
+
+_local = threading.local()
+_server_lock = threading.Lock()
+_server_running = None  # None until the first start_metrics_server() call
+
+if Histogram is not None:
+    stage_seconds = Histogram('climateincome_stage_seconds', 'Time spent per figure pipeline stage',
+                              ['stage', 'source'], buckets=BUCKETS)
+    # label lookups are not free, resolve them once
+    _stage_children = {(stage, source): stage_seconds.labels(stage, source)
+                       for stage in STAGES for source in SOURCES}
+    payload_bytes = Histogram('climateincome_payload_bytes', 'JSON size of the served figures',
+                              ['encoding'], buckets=PAYLOAD_BUCKETS)
+    _payload_children = {encoding: payload_bytes.labels(encoding) for encoding in ['raw', 'encoded']}
+else:
+    _stage_children = {}
+    _payload_children = {}
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        source = getattr(_local, 'source', SOURCES[0])
+        child = _stage_children.get((stage, source))
+        if child is None and Histogram is not None:
+            child = _stage_children.setdefault((stage, source), stage_seconds.labels(stage, source))
+        if child is not None:
+            child.observe(seconds)
+        spans = getattr(_local, 'spans', None)
+        if spans is not None:
+            spans.append((stage, seconds))
+
+def set_source(source):
+    # the source label of the spans of this thread from now on
+    _local.source = source
+
+def payload(fig_json):
+    # records the sizes of a served figure, from the encoding stage; returns fig_json
+    encoded = len(fig_json.encode('utf-8'))
+    raw = getattr(fig_json, 'raw_bytes', None) or encoded
+    if _payload_children:
+        _payload_children['raw'].observe(raw)
+        _payload_children['encoded'].observe(encoded)
+    payloads = getattr(_local, 'payloads', None)
+    if payloads is not None:
+        payloads.append((raw, encoded))
+    return fig_json
+
+def start_run():
+    # starts collecting the spans and payloads of this thread, e.g. for one app rerun
+    _local.spans = []
+    _local.payloads = []
+
+def run_spans():
+    # [(stage, seconds)] since start_run(), in the order the spans ended
+    return list(getattr(_local, 'spans', None) or [])
+
+def run_payloads():
+    # [(raw bytes, encoded bytes)] of the figures served since start_run()
+    return list(getattr(_local, 'payloads', None) or [])
+
+
+class CacheCollector:
+    # reads the registry and figure cache counters at scrape time
+
+    def describe(self):
+        # registering would otherwise call collect(), at import time
+        return []
+
+    def collect(self):
+        # imported here, prefetch imports the figure pipeline, which imports this module
+        from prefetch import prefetcher
+        for name, stats in [('dataset_registry', registry.stats()),
+                            ('figure_cache', figure_cache.stats()),
+                            ('prefetch', prefetcher.stats())]:
+            for key in ['hits', 'misses', 'reloads', 'evictions', 'built', 'cancelled', 'dropped']:
+                if key in stats:
+                    counter = CounterMetricFamily(f'climateincome_{name}_{key}',
+                                                  f'{name} {key}')
+                    counter.add_metric([], stats[key])
+                    yield counter
+            for key in ['files', 'entries', 'bytes', 'pending', 'hit_rate']:
+                if key in stats:
+                    gauge = GaugeMetricFamily(f'climateincome_{name}_{key}', f'{name} {key}')
+                    gauge.add_metric([], stats[key])
+                    yield gauge
+
+
+if Histogram is not None:
+    REGISTRY.register(CacheCollector())
+
+
+def start_metrics_server(port=METRICS_PORT):
+    # once per process; returns False when prometheus-client is missing or the port is taken
+    global _server_running
+    if Histogram is None:
+        return False
+    with _server_lock:
+        if _server_running is None:
+            try:
+                start_http_server(port, addr='127.0.0.1')
+                _server_running = True
+            except OSError as e:
+                print(f"Warning. Metrics server not started on port {port}: {e}")
+                _server_running = False
+    return _server_running
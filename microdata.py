@@ -0,0 +1,146 @@
+import argparse
+import pathlib
+import numpy as np
+import pandas as pd
+from datastore import write_store
+from process_rawdata import DATA_PATH, RAWDATA_PATH, get_config, test_data
+
+# Aggregates household survey microdata (one row per household) to income
+# quantiles in the schema of datasets/<country>.csv. Files are streamed in
+# chunks, so memory use does not grow with the number of households:
+#   pass 1: income range
+#   pass 2: weighted income histogram -> quantile boundaries
+#   pass 3: assign households to quantiles and aggregate per quantile
+
+CATEGORIES = ['energy', 'transport', 'food']
+DEFAULT_COLUMNS = {'income': 'income', 'weight': 'weight',
+                   'energy': 'energy', 'transport': 'transport', 'food': 'food'}
+CHUNKSIZE = 1_000_000
+HISTOGRAM_BINS = 2**16
+
+
+def read_chunks(path, columns, chunksize=CHUNKSIZE):
+    # yields dicts of float arrays, for .csv and .parquet files
+    path = pathlib.Path(path)
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield {col: batch.column(i).to_numpy(zero_copy_only=False).astype(float)
+                   for i, col in enumerate(batch.schema.names)}
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            yield {col: chunk[col].to_numpy(dtype=float) for col in columns}
+
+def _valid(chunk, income_col, weight_col):
+    income, weight = chunk[income_col], chunk[weight_col]
+    return np.isfinite(income) & np.isfinite(weight) & (weight > 0)
+
+def income_range(path, columns=DEFAULT_COLUMNS, chunksize=CHUNKSIZE):
+    low, high = np.inf, -np.inf
+    for chunk in read_chunks(path, [columns['income'], columns['weight']], chunksize):
+        income = chunk[columns['income']][_valid(chunk, columns['income'], columns['weight'])]
+        if len(income):
+            low, high = min(low, income.min()), max(high, income.max())
+    if low > high:
+        raise ValueError(f"no households with a valid income and weight in {path}")
+    return low, high
+
+def quantile_boundaries(path, n_quantiles=10, columns=DEFAULT_COLUMNS,
+                        chunksize=CHUNKSIZE, n_bins=HISTOGRAM_BINS):
+    """Weighted income quantile boundaries (n_quantiles - 1 values).
+
+    Boundaries are interpolated within a weighted histogram of the incomes,
+    so they are accurate to (max income - min income) / n_bins.
+    """
+    low, high = income_range(path, columns, chunksize)
+    edges = np.linspace(low, high, n_bins + 1)
+    hist = np.zeros(n_bins)
+    for chunk in read_chunks(path, [columns['income'], columns['weight']], chunksize):
+        mask = _valid(chunk, columns['income'], columns['weight'])
+        bins = np.searchsorted(edges, chunk[columns['income']][mask], side='right') - 1
+        hist += np.bincount(np.clip(bins, 0, n_bins - 1),
+                            weights=chunk[columns['weight']][mask], minlength=n_bins)
+    cum_weight = np.concatenate([[0.], np.cumsum(hist)])
+    targets = cum_weight[-1] * np.arange(1, n_quantiles) / n_quantiles
+    return np.interp(targets, cum_weight, edges)
+
+def aggregate(path, boundaries, intensities, price, dividend_share=1.0,
+              columns=DEFAULT_COLUMNS, chunksize=CHUNKSIZE):
+    """Weighted mean payment, revenue and net gain per income quantile.
+
+    intensities maps each category to tCO2 per currency unit spent. The
+    revenue is a flat dividend per household: dividend_share of the total
+    payment, divided over all households.
+    """
+    n_quantiles = len(boundaries) + 1
+    weights = np.zeros(n_quantiles)
+    tco2 = np.zeros(n_quantiles)
+    read_columns = [columns['income'], columns['weight']] + [columns[cat] for cat in intensities]
+    for chunk in read_chunks(path, read_columns, chunksize):
+        mask = _valid(chunk, columns['income'], columns['weight'])
+        weight = chunk[columns['weight']][mask]
+        household_tco2 = sum(np.nan_to_num(chunk[columns[cat]][mask]) * intensity
+                             for cat, intensity in intensities.items())
+        bins = np.searchsorted(boundaries, chunk[columns['income']][mask], side='right')
+        weights += np.bincount(bins, weights=weight, minlength=n_quantiles)
+        tco2 += np.bincount(bins, weights=weight * household_tco2, minlength=n_quantiles)
+    tco2 = np.divide(tco2, weights, out=np.full(n_quantiles, np.nan), where=weights > 0)
+    payments = price * tco2
+    revenue = dividend_share * np.nansum(payments * weights) / weights.sum()
+    df = pd.DataFrame({'carbon payment': payments,
+                       'carbon revenue': np.full(n_quantiles, revenue),
+                       'net gain': revenue - payments,
+                       'calc_tCO2': tco2},
+                      index=pd.Index(np.arange(1, n_quantiles + 1), name='income decile'))
+    return df
+
+def quantile_table(path, intensities, price, n_quantiles=10, dividend_share=1.0,
+                   columns=DEFAULT_COLUMNS, chunksize=CHUNKSIZE):
+    columns = {**DEFAULT_COLUMNS, **columns}
+    boundaries = quantile_boundaries(path, n_quantiles, columns, chunksize)
+    return aggregate(path, boundaries, intensities, price, dividend_share, columns, chunksize)
+
+def metadata_for(country, price, price_unit=None, text=None, origin=None, raw_path=RAWDATA_PATH):
+    # the country's metadata JSON if there is one, at the aggregation price
+    try:
+        metadata = get_config(pathlib.Path(raw_path) / f'{country}.json')
+    except FileNotFoundError:
+        if price_unit is None:
+            raise ValueError(f"{country} has no {raw_path}/{country}.json, the price unit is required")
+        metadata = {'text': f"{country} scenario from household microdata, based on a CO2 price of "
+                            f"{price:g} {price_unit} per tCO2",
+                    'time_unit': 'year', 'origin': 'household microdata'}
+    metadata['price'] = f"{price:g}"
+    for key, value in (('price_unit', price_unit), ('text', text), ('origin', origin)):
+        if value is not None:
+            metadata[key] = value
+    return metadata
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate household microdata to income quantiles')
+    parser.add_argument('path', help='household microdata (.csv or .parquet)')
+    parser.add_argument('country', help=f'output is written to {DATA_PATH}/<country>.csv and the store')
+    parser.add_argument('--price', type=float, required=True, help='carbon price per tCO2')
+    parser.add_argument('--price-unit', default=None,
+                        help=f'currency of the price and spends; required without {RAWDATA_PATH}/<country>.json')
+    parser.add_argument('--text', default=None, help='scenario description shown in the app')
+    parser.add_argument('--origin', default=None, help='source of the microdata')
+    for cat in CATEGORIES:
+        parser.add_argument(f'--{cat}-intensity', type=float, default=0.,
+                            help=f'tCO2 per currency unit of {cat} spend')
+    parser.add_argument('--quantiles', type=int, default=10)
+    parser.add_argument('--dividend-share', type=float, default=1.0)
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+
+    intensities = {cat: getattr(args, f'{cat}_intensity') for cat in CATEGORIES
+                   if getattr(args, f'{cat}_intensity')}
+    metadata = metadata_for(args.country, args.price, args.price_unit, args.text, args.origin)
+    df = quantile_table(args.path, intensities, args.price, args.quantiles,
+                        args.dividend_share, chunksize=args.chunksize)
+    test_data(df)
+    print(f"Writing output data to {DATA_PATH / f'{args.country}.csv'} and the store")
+    df.to_csv(DATA_PATH / f'{args.country}.csv')
+    # the registry reads the store partition of a country before its CSV file
+    write_store(df, args.country, metadata, DATA_PATH / 'store')
@@ -0,0 +1,369 @@
+import numpy as np
+import plotly.graph_objects as go
+
+
+col_list = ['carbon revenue', 'carbon payment', 'net gain']
+
+rgb_dict = {'carbon payment': 'rgb(122, 138, 184)',
+            'carbon revenue': 'rgb(128, 179, 128)',
+            'net gain': 'rgb(69, 161, 69)'
+            }
+
+name_dict =  {'carbon payment': 'Payment',
+            'carbon revenue': 'Climate Income',
+            'net gain' : 'Net gain'}
+
+title_country_dict = {'belgium': 'Belgium',
+                        'uk': 'UK'}
+# axis title per number of quantile bins
+xlabel_quantile_dict = {5: 'Income Quintile',
+                        10: 'Income Decile',
+                        100: 'Income Percentile'}
+
+paper_bgcolor='rgb(248, 248, 255)'
+plot_bgcolor='rgb(248, 248, 255)'
+bargroupgap = 0.15
+
+label_font = dict(family='Arial', size=14, color='rgb(240, 240, 250)')
+
+# From this many quantile bins on, bars and marker lines become WebGL lines, and
+# only MAX_LABELS evenly spread quantiles per column get a label or arrow.
+HIGH_RESOLUTION_BINS = 100
+MAX_LABELS = 20
+
+
+def _oriented(quantile_axis, money_axis, orientation):
+    # returns (x, y)
+    if orientation == 'h':
+        return money_axis, quantile_axis
+    return quantile_axis, money_axis
+
+def column_values(df, cols, payment_negative=False):
+    # (len(cols), n_quantiles) float array, with the payment sign flipped if requested
+    values = df[cols].to_numpy(dtype=float).T.copy()
+    if payment_negative and 'carbon payment' in cols:
+        values[cols.index('carbon payment')] *= -1
+    return values
+
+def quantile_title(n_quantiles):
+    return xlabel_quantile_dict.get(n_quantiles, 'Income Quantile')
+
+def high_resolution(n_quantiles):
+    return n_quantiles >= HIGH_RESOLUTION_BINS
+
+def label_subset(n, max_labels=MAX_LABELS):
+    # positions of at most max_labels evenly spread labels, the first and last included
+    if n <= max_labels:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max_labels).round().astype(int))
+
+def bar_label_annotations(idx, values, offsets, orientation='h', font=label_font, max_labels=None):
+    # one label per bar (or per max_labels spread bars), halfway along the bar, for all columns at once
+    if max_labels is not None:
+        subset = label_subset(len(idx), max_labels)
+        idx, values = np.asarray(idx)[subset], values[:, subset]
+    positions = np.asarray(idx, dtype=float)[None, :] + np.asarray(offsets)[:, None]
+    x, y = _oriented(positions, 0.5 * values, orientation)
+    texts = np.char.mod('%.0f', values)
+    return [dict(xref='x', yref='y', x=x_i, y=y_i, text=text, font=font, showarrow=False)
+            for x_i, y_i, text in zip(x.ravel().tolist(), y.ravel().tolist(), texts.ravel().tolist())]
+
+def delta_annotations(payment, revenue, orientation='h', max_labels=None):
+    # an arrow from payment to revenue for each quantile (or for max_labels spread
+    # quantiles), labelled with the net gain
+    positions = np.arange(1, len(payment) + 1, dtype=float)
+    if max_labels is not None:
+        subset = label_subset(len(payment), max_labels)
+        positions, payment, revenue = positions[subset], payment[subset], revenue[subset]
+    x0, y0 = _oriented(positions, payment, orientation)
+    x1, y1 = _oriented(positions, revenue, orientation)
+    x_mid, y_mid = (x0 + x1) / 2, (y0 + y1) / 2
+    texts = np.char.mod('%.0f', revenue - payment)
+    arrow_font = dict(family='Arial', size=14, color=rgb_dict.get('carbon revenue'))
+    text_font = dict(family='Arial', size=16, color="rgb(240, 250, 240)")
+    annotations = []
+    for ax, x, ay, y, xm, ym, text in zip(x0.tolist(), x1.tolist(), y0.tolist(), y1.tolist(),
+                                          x_mid.tolist(), y_mid.tolist(), texts.tolist()):
+        annotations.append(dict(xref='x', yref='y',
+                                ax=ax, x=x,
+                                ay=ay, y=y,
+                                axref='x', ayref='y',
+                                text="",
+                                font=arrow_font,
+                                xanchor='left',
+                                yanchor='bottom',
+                                arrowhead=5,
+                                arrowwidth=4,
+                                arrowcolor=rgb_dict.get('net gain'),
+                                showarrow=True))
+        annotations.append(dict(xref='x', yref='y',
+                                x=xm,
+                                y=ym,
+                                xanchor='left',
+                                yanchor='top',
+                                text=text,
+                                font=text_font,
+                                showarrow=False,
+                                textangle=0,
+                                bgcolor=rgb_dict.get('carbon revenue', 'rgb(100,100,100)'),
+                                opacity=0.8
+                                ))
+    return annotations
+
+def revenue_line_annotation(idx, revenue, orientation='h'):
+    value = revenue.mean()
+    x, y = _oriented(np.mean(idx), value, orientation)
+    return dict(xref='x', yref='y',
+                x=x, y=y,
+                xanchor='center',
+                yanchor='bottom',
+                text=f'Climate Income: {value:.0f}',
+                font=dict(family='Arial', size=16,
+                          color="rgb(240, 250, 240)"),
+                showarrow=False,
+                textangle=90 if orientation == 'h' else 0,
+                bgcolor=rgb_dict.get('carbon revenue', 'rgb(100,100,100)'),
+                opacity=0.9
+                )
+
+
+def error_bars(values, bands, orientation='h'):
+    # asymmetric error bars from the (lower, upper) band around the plotted values
+    lower, upper = bands
+    error = dict(type='data', symmetric=False,
+                 array=np.maximum(upper - values, 0), arrayminus=np.maximum(values - lower, 0),
+                 color='rgb(60, 60, 60)', thickness=1.5)
+    return dict(error_x=error) if orientation == 'h' else dict(error_y=error)
+
+def bar_traces(idx, values, cols, orientation='h', width=None, error_bands=None):
+    # error_bands maps columns to (lower, upper) arrays
+    error_bands = error_bands or {}
+    traces = []
+    for col, col_values in zip(cols, values):
+        x, y = _oriented(idx, col_values, orientation)
+        errors = error_bars(col_values, error_bands[col], orientation) if col in error_bands else {}
+        traces.append(go.Bar(x=x,
+                        y=y,
+                        name=name_dict.get(col),
+                        marker_color=rgb_dict.get(col, 'rgb(100,100,100)'),
+                        orientation=orientation,
+                        width=width,
+                        **errors
+                        ))
+    return traces
+
+def revenue_line_trace(idx, revenue, orientation='h'):
+    # a single line across all quantiles at the (flat) revenue level
+    quantile_range = [np.min(idx) - 0.5, np.max(idx) + 0.5]
+    x, y = _oriented(quantile_range, [revenue.min(), revenue.max()], orientation)
+    col = 'carbon revenue'
+    return go.Scatter(x=x,
+                      y=y,
+                      name=name_dict.get(col),
+                      orientation=orientation,
+                      line_color=rgb_dict.get(col, 'rgb(100,100,100)'),
+                      line_width=3,
+                      marker=dict(size=1),
+                      mode='lines+markers'
+                      )
+
+def line_traces(idx, values, cols, orientation='h'):
+    traces = []
+    textposition = "top center" if orientation == 'h' else "middle left"
+    for col, col_values in zip(cols, values):
+        x, y = _oriented(idx, col_values, orientation)
+        text_array = np.char.mod('%.0f', col_values)
+        if col != 'carbon payment':
+            # only label the first point of the flat revenue line
+            text_array[1:] = ''
+        traces.append(go.Scatter(x=x,
+                        y=y,
+                        name=name_dict.get(col),
+                        orientation=orientation,
+                        line_color=rgb_dict.get(col, 'rgb(100,100,100)'),
+                        line_width=3,
+                        marker=dict(size=20),
+                        mode='lines+markers+text',
+                        text=text_array.tolist(),
+                        textfont=dict(size=15),
+                        textposition=textposition,
+                        ))
+    return traces
+
+
+def gl_traces(idx, values, cols, orientation='h', fill=True, error_bands=None):
+    # WebGL lines for high-resolution charts, filled to the zero line in place of bars
+    error_bands = error_bands or {}
+    fill = ('tozerox' if orientation == 'h' else 'tozeroy') if fill else 'none'
+    traces = []
+    for col, col_values in zip(cols, values):
+        x, y = _oriented(idx, col_values, orientation)
+        errors = error_bars(col_values, error_bands[col], orientation) if col in error_bands else {}
+        traces.append(go.Scattergl(x=x,
+                                   y=y,
+                                   name=name_dict.get(col),
+                                   mode='lines',
+                                   fill=fill,
+                                   line_color=rgb_dict.get(col, 'rgb(100,100,100)'),
+                                   line_width=2,
+                                   **errors
+                                   ))
+    return traces
+
+
+def build_figure(traces, annotations, n_quantiles, meta_data, orientation='h', country=None,
+                 reverse=False, width=800, height=600):
+    # layout shared by all plot types
+    money_title = f"Payment/Revenue ({meta_data['price_unit']}/year)"
+    x_axis_title = money_title if orientation == 'h' else quantile_title(n_quantiles)
+    y_axis_title = quantile_title(n_quantiles) if orientation == 'h' else money_title
+    quantile_ticks = None if high_resolution(n_quantiles) else np.arange(1, n_quantiles+1)
+    if orientation == 'h':
+        xtickvals, ytickvals = None, quantile_ticks
+    else:
+        xtickvals, ytickvals = quantile_ticks, None
+
+    fig = go.Figure(data=traces)
+    if reverse:
+        if orientation == 'h':
+            fig.update_yaxes(autorange="reversed")
+        else:
+            fig.update_xaxes(autorange="reversed")
+    fig.update_layout(
+        annotations=annotations,
+        title=dict(
+            text=f'Yearly carbon fee and carbon revenue, {title_country_dict.get(country, country)}',
+            xanchor='center',
+            x=0.5,
+        ),
+        titlefont_size=20,
+        yaxis=dict(
+            title=y_axis_title,
+            titlefont_size=16,
+            tickfont_size=14,
+            tickvals=ytickvals
+        ),
+        xaxis=dict(
+            title=x_axis_title,
+            titlefont_size=16,
+            tickvals=xtickvals
+        ),
+        legend=dict(
+            x=1.0,
+            y=1.05,
+            bgcolor='rgba(200, 200, 210, 0.15)',
+            bordercolor='rgba(255, 255, 255, 0)'
+        ),
+        barmode='group',
+        bargap=0.15, # gap between bars of adjacent location coordinates.
+        bargroupgap=bargroupgap, # gap between bars of the same location coordinate.,
+        paper_bgcolor=paper_bgcolor,
+        plot_bgcolor=paper_bgcolor,
+        width=width,
+        height=height,
+    )
+    return fig
+
+
+def make_barplot(df, meta_data, orientation='h', payment_negative=False, error_bands=None, **layout):
+    idx = df['income decile'].to_numpy()
+    values = column_values(df, col_list, payment_negative)
+    if high_resolution(len(idx)):
+        traces = gl_traces(idx, values, col_list, orientation, error_bands=error_bands)
+        annotations = bar_label_annotations(idx, values, np.zeros(len(col_list)), orientation,
+                                            max_labels=MAX_LABELS)
+        return build_figure(traces, annotations, len(idx), meta_data, orientation, **layout)
+    offsets = (np.arange(len(col_list)) - 1) * (bargroupgap + 0.125)
+    traces = bar_traces(idx, values, col_list, orientation, error_bands=error_bands)
+    for trace in traces:
+        trace.width = 0.25
+    annotations = bar_label_annotations(idx, values, offsets, orientation)
+    return build_figure(traces, annotations, len(idx), meta_data, orientation, **layout)
+
+def make_bar_lineplot(df, meta_data, orientation='h', payment_negative=False, error_bands=None, **layout):
+    idx = df['income decile'].to_numpy()
+    bar_cols = [col_list[1], col_list[2]]
+    values = column_values(df, bar_cols, payment_negative)
+    revenue = df['carbon revenue'].to_numpy(dtype=float)
+    if high_resolution(len(idx)):
+        traces = [revenue_line_trace(idx, revenue, orientation)] + \
+            gl_traces(idx, values, bar_cols, orientation, error_bands=error_bands)
+        annotations = bar_label_annotations(idx, values, np.zeros(len(bar_cols)), orientation,
+                                            max_labels=MAX_LABELS)
+        annotations.append(revenue_line_annotation(idx, revenue, orientation))
+        return build_figure(traces, annotations, len(idx), meta_data, orientation, **layout)
+    offsets = (np.arange(len(bar_cols)) - 0.5) * (bargroupgap + 0.2)
+    traces = [revenue_line_trace(idx, revenue, orientation)] + \
+        bar_traces(idx, values, bar_cols, orientation, width=0.4, error_bands=error_bands)
+    annotations = bar_label_annotations(idx, values, offsets, orientation)
+    annotations.append(revenue_line_annotation(idx, revenue, orientation))
+    return build_figure(traces, annotations, len(idx), meta_data, orientation, **layout)
+
+def make_line_delta_plot(df, meta_data, orientation='h', payment_negative=False, error_bands=None, **layout):
+    # payments are always drawn as positive values in this plot, error bands are only drawn on bars
+    idx = df['income decile'].to_numpy()
+    line_col_list = ['carbon revenue', 'carbon payment']
+    values = column_values(df, line_col_list)
+    if high_resolution(len(idx)):
+        traces = gl_traces(idx, values, line_col_list, orientation, fill=False)
+        annotations = delta_annotations(values[1], values[0], orientation, max_labels=MAX_LABELS)
+        return build_figure(traces, annotations, len(idx), meta_data, orientation, **layout)
+    traces = line_traces(idx, values, line_col_list, orientation)
+    annotations = delta_annotations(values[1], values[0], orientation)
+    return build_figure(traces, annotations, len(idx), meta_data, orientation, **layout)
+
+
+def make_trajectory_plot(df, meta_data, results, frame_labels, orientation='h', payment_negative=False,
+                         **layout):
+    """Bar chart animated along a carbon-price trajectory, played back in the browser.
+
+    results holds one (n_frames, n_quantiles) array per column, as returned by
+    scenarios.sweep. The figure shows the first frame, every frame only carries
+    the bar lengths and labels that change. The amount axis is fixed to the
+    range over all frames.
+    """
+    idx = df['income decile'].to_numpy()
+    values = np.stack([results[col] for col in col_list], axis=1)  # (n_frames, n_cols, n_quantiles)
+    if payment_negative:
+        values[:, col_list.index('carbon payment')] *= -1
+    texts = np.char.mod('%.0f', values)
+    traces = bar_traces(idx, values[0], col_list, orientation)
+    for trace, text in zip(traces, texts[0]):
+        trace.update(width=0.25, text=text.tolist(), textposition='inside',
+                     insidetextanchor='middle', textfont=label_font)
+    fig = build_figure(traces, [], len(idx), meta_data, orientation, **layout)
+
+    money_axis = 'x' if orientation == 'h' else 'y'
+    fig.frames = [dict(name=label,
+                       traces=list(range(len(col_list))),
+                       data=[{'type': 'bar', money_axis: frame_values, 'text': frame_texts}
+                             for frame_values, frame_texts in zip(values[i], texts[i].tolist())])
+                  for i, label in enumerate(frame_labels)]
+    margin = 0.05 * (values.max() - min(values.min(), 0))
+    money_range = [min(values.min(), 0) - margin, values.max() + margin]
+    if orientation == 'h':
+        fig.update_xaxes(range=money_range)
+    else:
+        fig.update_yaxes(range=money_range)
+
+    def animate(frames, duration):
+        return [frames, dict(mode='immediate', fromcurrent=True,
+                             frame=dict(duration=duration, redraw=False),
+                             transition=dict(duration=min(duration, 300)))]
+    fig.update_layout(
+        updatemenus=[dict(type='buttons', direction='left', x=0, y=-0.12, xanchor='left', yanchor='top',
+                          showactive=False,
+                          buttons=[dict(label='Play', method='animate', args=animate(None, 600)),
+                                   dict(label='Pause', method='animate', args=animate([None], 0))])],
+        sliders=[dict(active=0, x=0.12, y=-0.08, len=0.88, xanchor='left', yanchor='top',
+                      currentvalue=dict(prefix='', font_size=14),
+                      steps=[dict(label=label, method='animate', args=animate([label], 0))
+                             for label in frame_labels])],
+        margin=dict(b=160),
+    )
+    return fig
+
+
+plot_builders = {'bars': make_barplot,
+                 'bars and line': make_bar_lineplot,
+                 'lines and delta': make_line_delta_plot}
@@ -0,0 +1,221 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+import figures
+import metrics
+from datastore import registry
+
+# Background prefetch of the views a user is likely to open next. After a
+# figure is served, the views one sidebar change away (the other quantile mode,
+# the other orientation, the other plot types; same country and price) are
+# built into the figure cache by a small pool of worker threads, off the
+# Streamlit script thread. On the first start the default view of every
+# country in datasets/ is warmed as well, and the uncertainty bands are sampled
+# once. With uncertainty bands on, the other quantile mode is not prefetched:
+# its bands may need a Monte-Carlo run on a process pool.
+#   prefetch.start()                  # once per process, queues the warm-up
+#   prefetcher.served(options)        # before serving, counts prefetch hits
+#   prefetcher.prefetch_next(options) # after serving
+# Each worker keeps to CPU_BUDGET of a core: after a build that took c seconds
+# of CPU it pauses c * (1 / CPU_BUDGET - 1) seconds. A new prefetch_next()
+# cancels the next views queued for the previous one of the same session (the
+# Streamlit session, or the client of the figure server); a build that already
+# runs finishes, plain Python code cannot be interrupted. The spans of
+# prefetch builds are exported with source="prefetch", apart from the users'.
+
+ENABLED = os.environ.get('CLIMATEINCOME_PREFETCH', '1').lower() not in ('0', 'false', 'no')
+PREFETCH_WORKERS = int(os.environ.get('CLIMATEINCOME_PREFETCH_WORKERS', 1))
+CPU_BUDGET = float(os.environ.get('CLIMATEINCOME_PREFETCH_BUDGET', 0.5))
+MAX_PENDING = 32
+# sessions whose latest generation is kept; the queued next views of older ones are cancelled
+MAX_SESSIONS = 1024
+# queue priorities: the next views of the current user before the warm-up
+NEXT_VIEW, WARM_UP = 0, 1
+# the sidebar defaults of the app
+default_options = dict(quantiles='quintiles', orientation='h', plot_type='bars and line',
+                       payment_negative=False, price=None, uncertainty=False, currency=None)
+
+
+def stage_view(options):
+    # the options that select a cached figure: the country and the figure stage inputs
+    return {name: value for name, value in options.items()
+            if name == 'country' or name in figures.STAGE_INPUTS['figure']}
+
+def view_key(view):
+    stage_options = figures.figure_stage_options(**view)
+    return (view['country'], registry.version(view['country']), tuple(sorted(stage_options.items())))
+
+def next_views(options):
+    # the views one sidebar change away, most likely first; without the other
+    # quantile mode when it would need new uncertainty bands (not in the CPU budget)
+    view = stage_view(options)
+    views = []
+    for name, choices in [('quantiles', figures.quantile_choices(view['country'])),
+                          ('orientation', list(figures.orientation_options.values())),
+                          ('plot_type', figures.plot_type_options)]:
+        if name == 'quantiles' and view['uncertainty']:
+            continue
+        views += [dict(view, **{name: choice}) for choice in choices if choice != view[name]]
+    return views
+
+
+class Prefetcher:
+    """Builds figures into the figure cache on background threads.
+
+    Counts a hit for every served view that a prefetch had built, and a miss
+    for every served view that was not cached yet.
+    """
+
+    def __init__(self, workers=PREFETCH_WORKERS, cpu_budget=CPU_BUDGET, max_pending=MAX_PENDING):
+        self.workers = workers
+        self.cpu_budget = cpu_budget
+        self.max_pending = max_pending
+        # (priority, sequence, (session, generation) or None, view)
+        self._queue = queue.PriorityQueue()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._generations = OrderedDict()  # session -> latest generation
+        self._threads = []
+        self._prefetched = set()  # view keys built by a prefetch and not served yet
+        self.hits = 0
+        self.misses = 0
+        self.built = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.errors = 0
+        self.cpu_seconds = 0.
+
+    def start(self):
+        # returns False if the workers were already running
+        with self._lock:
+            if self._threads:
+                return False
+            self._threads = [threading.Thread(target=self._work, name=f'prefetch-{i}', daemon=True)
+                             for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return True
+
+    def _put(self, views, priority, generation):
+        for view in views:
+            if self._queue.qsize() >= self.max_pending:
+                with self._lock:
+                    self.dropped += 1
+                continue
+            self._queue.put((priority, next(self._sequence), generation, view))
+
+    def _cancel_next_views(self, session):
+        # takes the queued next views of the session out, puts the others back
+        kept = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] == NEXT_VIEW and item[2][0] == session:
+                with self._lock:
+                    self.cancelled += 1
+            else:
+                kept.append(item)
+            self._queue.task_done()
+        for item in kept:
+            self._queue.put(item)
+
+    def _current(self, generation):
+        # False once the session has a newer generation
+        session, number = generation
+        with self._lock:
+            return self._generations.get(session) == number
+
+    def prefetch_next(self, options, session=None):
+        with self._lock:
+            number = self._generations.pop(session, 0) + 1
+            self._generations[session] = number
+            while len(self._generations) > MAX_SESSIONS:
+                self._generations.popitem(last=False)
+        self._cancel_next_views(session)
+        self._put(next_views(options), NEXT_VIEW, (session, number))
+
+    def warm_up(self, countries=None):
+        # the default view of every country with a dataset
+        countries = registry.countries() if countries is None else countries
+        self._put([dict(default_options, country=country) for country in countries], WARM_UP, None)
+
+    def served(self, options):
+        # call before serving a view; True if a prefetch built it
+        view = stage_view(options)
+        key = view_key(view)
+        cached = figures.figure_cached(**view)
+        with self._lock:
+            prefetched = key in self._prefetched
+            self._prefetched.discard(key)
+            if prefetched and cached:
+                self.hits += 1
+                return True
+            if not cached:
+                self.misses += 1
+            return False
+
+    def _work(self):
+        metrics.set_source('prefetch')
+        while True:
+            priority, _, generation, view = self._queue.get()
+            try:
+                if priority == NEXT_VIEW and not self._current(generation):
+                    with self._lock:
+                        self.cancelled += 1
+                    continue
+                if figures.figure_cached(**view):
+                    continue
+                start = time.thread_time()
+                try:
+                    figures.base_figure_json(**view)
+                except Exception as e:
+                    # the foreground build of this view will raise it again
+                    print(f"Warning. Prefetch of {view} failed: {e}")
+                    with self._lock:
+                        self.errors += 1
+                    continue
+                cpu_seconds = time.thread_time() - start
+                with self._lock:
+                    self._prefetched.add(view_key(view))
+                    self.built += 1
+                    self.cpu_seconds += cpu_seconds
+                time.sleep(cpu_seconds * (1 / self.cpu_budget - 1))
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        # waits until the queue is worked off
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            served = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / served if served else 0.,
+                    'built': self.built,
+                    'cancelled': self.cancelled,
+                    'dropped': self.dropped,
+                    'errors': self.errors,
+                    'pending': self._queue.qsize(),
+                    'cpu_seconds': self.cpu_seconds}
+
+
+prefetcher = Prefetcher()
+
+
+def start(warm_up=True):
+    # once per process; the warm-up is queued by the call that starts the workers
+    if not ENABLED:
+        return False
+    started = prefetcher.start()
+    if started and warm_up:
+        prefetcher.warm_up()
+        # the Monte-Carlo runs of the uncertainty bands, on the process pool they create
+        threading.Thread(target=figures.warm_up_error_bands, name='band-warm-up', daemon=True).start()
+    return started
@@ -1,14 +1,30 @@
-import pandas as pd
+import argparse
+import hashlib
 import pathlib
 import json
+from concurrent.futures import ProcessPoolExecutor
+from datastore import ERRORS_FILE, store_file, write_store
+from readers import read_long, read_wide
 
 def get_config(path):
     with open(path, "r") as jsonfile:
         return(json.load(jsonfile))
 DATA_PATH = pathlib.Path(r'datasets')
 RAWDATA_PATH = pathlib.Path(r'datasets/raw')
+MANIFEST_FILE = DATA_PATH / 'manifest.json'
 MANDATORY_COLUMNS = ['carbon payment', 'carbon revenue', 'net gain']
 
+# country -> dict(func, raw_files, version). A parser takes the raw data path
+# and returns (df, metadata, error estimates or None). Bump the version when a
+# parser changes, so its country is processed again.
+PARSERS = {}
+
+def register_parser(country, raw_files, version=1):
+    def decorator(func):
+        PARSERS[country] = dict(func=func, raw_files=list(raw_files), version=version)
+        return func
+    return decorator
+
 def test_data(df):
     EPS = 1.E-0
     for col in MANDATORY_COLUMNS:
@@ -21,72 +37,133 @@ def test_data(df):
     if abs(df['net gain'].sum()) > EPS:
         print(f"(Warning, this is not equal to zero!")
 
-# Belgium
-column_names = ["bar number", "price", "income decile", "payment/revenue"]
-pivot_dict = {"values" : "price",
-              "index" : "income decile",
-              "columns" : "payment/revenue"}
-revenue_column = 'carbon revenue'
-payment_column = 'carbon payment'
-post_average_column = 'carbon revenue'
-net_gain_column = 'net gain'
-decile_column = 'income decile'
-
-belgium_metadata = get_config(RAWDATA_PATH / 'belgium.json')
-belgium_df = pd.read_csv(RAWDATA_PATH / 'belgium.csv', sep=', ', header=None, engine='python')
-belgium_df.columns = column_names
-belgium_df[decile_column] = belgium_df[decile_column] + 1
-belgium_df = belgium_df.pivot(**pivot_dict)
-
-
-
-try:
-    belgium_std_error = belgium_df[revenue_column].std()
-    belgium_std_mae = (belgium_df[revenue_column] - belgium_df[payment_column] - belgium_df[net_gain_column]).abs().mean()
-except KeyError:
-    print(f"Warning. Could not find revenue column {revenue_col}. Existing column names: {list(belgium_df.columns)}")
-
-try:
-    belgium_df[post_average_column] = belgium_df[post_average_column].mean()
-except KeyError:
-    print(f"Warning. Could not find column {post_average_column} for revenue averaging. Existing column names: {list(belgium_df.columns)}"\
-    "No averaging over deciles was applied")
-
-try:
-    belgium_df['calc_tCO2'] = belgium_df[payment_column] / float(belgium_metadata['info']['price'])
-except KeyError:
-    print(f"Warning. Could not find column '{payment_column}' for calculating effective CO2 emission based on price and payment. "\
-    f"Existing column names: {list(belgium_df.columns)}"
-    "Not calculating calc_tCO2")
-
-print(f"The estimated error (standard deviation) for Belgium is +/- {belgium_std_error:.2f} {belgium_metadata['info']['price_unit']}")
-print(f"The estimated error (MAE) for Belgium is {belgium_std_mae:.3f} {belgium_metadata['info']['price_unit']}")
-print(f"Writing Belgium output data to {DATA_PATH / 'belgium.csv'}")
-test_data(belgium_df)
-belgium_df.to_csv(DATA_PATH / 'belgium.csv')
-
-
-
-#UK
-uk_df = pd.read_csv(RAWDATA_PATH / 'UK.csv', decimal=',')
-unnamed_cols = [col for col in uk_df.columns if 'Unnamed' in col]
-# drop all unnamed columns except for Unnamed: 0
-uk_df = uk_df.drop(columns=unnamed_cols[1:])
-uk_df = uk_df.rename(columns={unnamed_cols[0]:'category'})
-uk_df = uk_df.set_index('category')
-uk_df = uk_df.T
-# bring the deciles back as a column (modifying indices is a pain)
-uk_df = uk_df.reset_index()
-uk_df = uk_df[uk_df['index'] != 'Total']
-uk_df['income decile'] = uk_df['index'].str.extract(r'(\d+)').astype(int)
-uk_df = uk_df.set_index('income decile')
-uk_df = uk_df.drop(columns=['index'])
-
-
-uk_df['carbon payment'] = uk_df.iloc[:, :3].sum(axis=1)
-uk_df = uk_df.rename(columns={'Household Dividend' : 'carbon revenue'})
-uk_df['net gain'] = uk_df['carbon revenue'] - uk_df['carbon payment']
-print(uk_df['net gain'])
-print(uk_df['net gain'].sum())
-test_data(uk_df)
-uk_df.to_csv(DATA_PATH / 'uk.csv')
+
+# Belgium: values digitized from a bar chart, one row per bar
+@register_parser('belgium', ['belgium.csv', 'belgium.json'])
+def parse_belgium(raw_path=RAWDATA_PATH):
+    column_names = ["bar number", "price", "income decile", "payment/revenue"]
+    pivot_dict = {"values" : "price",
+                  "index" : "income decile",
+                  "columns" : "payment/revenue"}
+    revenue_column = 'carbon revenue'
+    payment_column = 'carbon payment'
+    post_average_column = 'carbon revenue'
+    net_gain_column = 'net gain'
+
+    belgium_metadata = get_config(raw_path / 'belgium.json')
+    # chunked C-engine read and pivot, see readers.py
+    belgium_df = read_long(raw_path / 'belgium.csv', column_names, **pivot_dict)
+    belgium_df.index = belgium_df.index + 1
+
+    errors = None
+    try:
+        belgium_std_error = belgium_df[revenue_column].std()
+        belgium_std_mae = (belgium_df[revenue_column] - belgium_df[payment_column] - belgium_df[net_gain_column]).abs().mean()
+        errors = {'std_error': belgium_std_error, 'mae': belgium_std_mae}
+        print(f"The estimated error (standard deviation) for Belgium is +/- {belgium_std_error:.2f} {belgium_metadata['price_unit']}")
+        print(f"The estimated error (MAE) for Belgium is {belgium_std_mae:.3f} {belgium_metadata['price_unit']}")
+    except KeyError:
+        print(f"Warning. Could not find revenue column {revenue_column}. Existing column names: {list(belgium_df.columns)}")
+
+    try:
+        belgium_df[post_average_column] = belgium_df[post_average_column].mean()
+    except KeyError:
+        print(f"Warning. Could not find column {post_average_column} for revenue averaging. Existing column names: {list(belgium_df.columns)}"\
+        "No averaging over deciles was applied")
+
+    try:
+        belgium_df['calc_tCO2'] = belgium_df[payment_column] / float(belgium_metadata['price'])
+    except KeyError:
+        print(f"Warning. Could not find column '{payment_column}' for calculating effective CO2 emission based on price and payment. "\
+        f"Existing column names: {list(belgium_df.columns)}"
+        "Not calculating calc_tCO2")
+    return belgium_df, belgium_metadata, errors
+
+
+# UK: statistics table with the categories as rows and the deciles as columns
+@register_parser('uk', ['UK.csv', 'uk.json'])
+def parse_uk(raw_path=RAWDATA_PATH):
+    # chunked C-engine read, transposed to one row per decile ('Total' and unnamed columns dropped)
+    uk_df = read_wide(raw_path / 'UK.csv', index_name='income decile', decimal=',')
+
+
+    uk_df['carbon payment'] = uk_df.iloc[:, :3].sum(axis=1)
+    uk_df = uk_df.rename(columns={'Household Dividend' : 'carbon revenue'})
+    uk_df['net gain'] = uk_df['carbon revenue'] - uk_df['carbon payment']
+    print(uk_df['net gain'])
+    return uk_df, get_config(raw_path / 'uk.json'), None
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def fingerprint(country, raw_path=RAWDATA_PATH):
+    parser = PARSERS[country]
+    return {'version': parser['version'],
+            'files': {name: file_hash(raw_path / name) for name in parser['raw_files']}}
+
+def read_json(path):
+    try:
+        return get_config(path)
+    except FileNotFoundError:
+        return {}
+
+def outputs_exist(country, data_path=DATA_PATH):
+    # the CSV and the store partition written by process_country
+    return (data_path / f'{country}.csv').exists() and store_file(country, data_path / 'store').exists()
+
+def process_country(country, raw_path=RAWDATA_PATH, data_path=DATA_PATH):
+    print(f"Processing {country}")
+    df, metadata, errors = PARSERS[country]['func'](raw_path)
+    test_data(df)
+    print(f"Writing {country} output data to {data_path / f'{country}.csv'}")
+    df.to_csv(data_path / f'{country}.csv')
+    write_store(df, country, metadata, data_path / 'store')
+    return errors
+
+def run(countries=None, force=False, n_workers=None, raw_path=RAWDATA_PATH, data_path=DATA_PATH):
+    """Process the countries whose raw files or parser changed since the last run,
+    or whose output files are missing.
+
+    Changed countries are processed in parallel. The manifest (content hashes
+    of the raw files) and the error estimates are only written by this process.
+    """
+    countries = list(PARSERS) if countries is None else countries
+    manifest_file, errors_file = data_path / MANIFEST_FILE.name, data_path / ERRORS_FILE.name
+    manifest = read_json(manifest_file)
+    fingerprints = {country: fingerprint(country, raw_path) for country in countries}
+    changed = [country for country in countries if force or manifest.get(country) != fingerprints[country]
+               or not outputs_exist(country, data_path)]
+    for country in [country for country in countries if country not in changed]:
+        print(f"Skipping {country}, raw data unchanged")
+    if not changed:
+        return changed
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        results = list(pool.map(process_country, changed,
+                                [raw_path] * len(changed), [data_path] * len(changed)))
+
+    # error estimates of the digitized data, used for the uncertainty bands in the app
+    errors = read_json(errors_file)
+    for country, country_errors in zip(changed, results):
+        manifest[country] = fingerprints[country]
+        if country_errors is not None:
+            errors[country] = country_errors
+    with open(errors_file, "w") as jsonfile:
+        json.dump(errors, jsonfile, indent=1)
+    with open(manifest_file, "w") as jsonfile:
+        json.dump(manifest, jsonfile, indent=1, sort_keys=True)
+    return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process raw country data to datasets/')
+    parser.add_argument('countries', nargs='*', help=f'default: all of {", ".join(PARSERS)}')
+    parser.add_argument('--force', action='store_true', help='also process unchanged raw data')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    run(args.countries or None, force=args.force, n_workers=args.workers)
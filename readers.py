@@ -0,0 +1,106 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Chunked readers of the raw exports, with the pandas C parser: only one chunk
+# of rows and the accumulated result are in memory, never the whole file or a
+# frame of strings.
+#   long format: 'Bar0, 109.37, 0, carbon payment', one value per row, pivoted
+#                to one row per bin and one column per category
+#   wide format: one row per category, one column per bin ('Income Decile 1',
+#                ...), transposed to one row per bin
+# Keys that occur more than once are averaged; in the raw files so far every
+# key occurs once, and the result equals pivot() or transpose() of the file.
+# Numbers are parsed as by the python engine (long) and the C engine defaults
+# (wide) of the reads they replace, to the last bit.
+
+CHUNK_ROWS = 1_000_000
+
+
+def _accumulate(acc, key, offset, values):
+    # acc[key][offset:offset + len(values)] += values, growing acc[key] by half its size
+    old = acc.get(key)
+    end = offset + len(values)
+    if old is None or len(old) < end:
+        grown = np.zeros(end if old is None else max(end, 3 * len(old) // 2), dtype=values.dtype)
+        if old is not None:
+            grown[:len(old)] = old
+        acc[key] = old = grown
+    old[offset:end] += values
+
+def read_long(path, names, values, index, columns, sep=',', chunksize=CHUNK_ROWS):
+    """Like pd.read_csv(path, header=None, names=names).pivot(index=index, columns=columns, values=values).
+
+    Fields may be followed by spaces (', '). The index column holds integers (bins).
+    """
+    sums, counts = {}, {}  # category -> per bin array
+    reader = pd.read_csv(path, sep=sep, skipinitialspace=True, header=None, names=names,
+                         usecols=[values, index, columns], dtype={index: np.int64, columns: str},
+                         float_precision='high', chunksize=chunksize)
+    for chunk in reader:
+        codes, categories = pd.factorize(chunk[columns])
+        bins = chunk[index].to_numpy()
+        if len(bins) and bins.min() < 0:
+            raise ValueError(f"{path}: negative {index} values")
+        chunk_values = chunk[values].to_numpy(dtype=float)
+        valid = ~np.isnan(chunk_values)
+        for code, category in enumerate(categories):
+            selected = (codes == code) & valid
+            if not selected.any():
+                continue
+            # counted from the smallest bin of the chunk, raw files are mostly sorted by bin
+            offset = bins[selected].min()
+            _accumulate(sums, category, offset,
+                        np.bincount(bins[selected] - offset, weights=chunk_values[selected]))
+            _accumulate(counts, category, offset, np.bincount(bins[selected] - offset).astype(np.int32))
+    n_bins = max((len(count) for count in counts.values()), default=0)
+    present = np.zeros(n_bins, dtype=bool)
+    for count in counts.values():
+        present[:len(count)] |= count > 0
+    bins = np.flatnonzero(present)
+    data = {}
+    for category in sorted(sums):
+        # popped, the accumulators are freed while the columns are built
+        total, count = sums.pop(category), counts.pop(category)
+        in_range = np.searchsorted(bins, len(count))
+        column = np.full(len(bins), np.nan)
+        with np.errstate(invalid='ignore'):
+            column[:in_range] = total[bins[:in_range]] / count[bins[:in_range]]
+        data[category] = column
+    df = pd.DataFrame(data, index=pd.Index(bins, name=index))
+    df.columns.name = columns
+    return df
+
+def read_wide(path, index_name='income decile', category_name='category', decimal=',',
+              chunksize=CHUNK_ROWS):
+    """The transpose of a file with the categories in the first column and one column per bin.
+
+    Bin columns are the named columns with a number, which becomes the index;
+    unnamed columns and columns without a number (e.g. 'Total') are dropped.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    bin_cols = [col for col in header[1:] if 'Unnamed' not in col and re.search(r'\d+', col)]
+    bins = [int(re.search(r'\d+', col).group(0)) for col in bin_cols]
+    sums = counts = None
+    order = []
+    reader = pd.read_csv(path, usecols=[header[0]] + bin_cols, decimal=decimal,
+                         dtype={header[0]: str, **{col: float for col in bin_cols}},
+                         chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk.set_index(header[0])[bin_cols]
+        grouped = chunk.groupby(level=0, sort=False)
+        chunk_sums, chunk_counts = grouped.sum(), grouped.count()
+        seen = set(order)
+        order += [category for category in chunk_sums.index if category not in seen]
+        if sums is None:
+            sums, counts = chunk_sums, chunk_counts
+        else:
+            sums = sums.add(chunk_sums, fill_value=0)
+            counts = counts.add(chunk_counts, fill_value=0)
+    if sums is None:
+        return pd.DataFrame(index=pd.Index(bins, name=index_name))
+    with np.errstate(invalid='ignore'):
+        means = sums.loc[order].to_numpy() / counts.loc[order].to_numpy()
+    df = pd.DataFrame(means.T, index=pd.Index(bins, name=index_name), columns=pd.Index(order))
+    df.columns.name = category_name
+    return df
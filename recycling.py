@@ -0,0 +1,171 @@
+import numpy as np
+from scipy.optimize import brentq, minimize_scalar
+
+# Budget-neutral revenue recycling schemes. The carbon revenue of a quantile
+# is split into dividends and a green investment share, so that the dividends
+# and the investment add up to the total payment (the sum of the net gains is
+# minus the investment). Schemes, each with the invested share g:
+#   'flat'      equal dividend for all, nothing invested (the datasets' scheme)
+#   'green'     equal dividend, a share g invested
+#   'tapered'   dividend falling linearly with income, by `taper` from the
+#               first to the last quantile, a share g invested
+#   'targeted'  any dividend per quantile
+# For each scheme and invested share the parameters minimize the average loss
+# of the bottom quantiles (BOTTOM_SHARE of the households), with the largest
+# loss of any quantile as tie-breaker. Candidates are evaluated in batches of
+# (n_candidates, n_quantiles) arrays. Quantiles hold equal numbers of households.
+
+GREEN_SHARES = np.linspace(0, 1, 41)
+TAPERS = np.linspace(0, 1, 101)
+BOTTOM_SHARE = 0.3
+# weight of the largest loss next to the bottom loss, only breaks ties
+TIE_BREAK = 1e-3
+schemes = ['flat', 'green', 'tapered', 'targeted']
+
+
+def bottom_count(n_quantiles):
+    return max(1, int(round(BOTTOM_SHARE * n_quantiles)))
+
+def evaluate(payment, dividends):
+    # objectives of a batch of (n_candidates, n_quantiles) dividends
+    net_gain = dividends - payment[None, :]
+    loss = np.maximum(-net_gain, 0)
+    return {'bottom_loss': loss[:, :bottom_count(len(payment))].mean(axis=1),
+            'max_loss': loss.max(axis=1),
+            'losers': (net_gain < 0).mean(axis=1)}
+
+def flat_dividends(payment, green_shares):
+    # (len(green_shares), n_quantiles)
+    green_shares = np.asarray(green_shares, dtype=float)
+    return np.outer(1 - green_shares, np.full(len(payment), payment.mean()))
+
+def tapered_dividends(payment, tapers, green_shares):
+    # tapers and green shares of the same length, or broadcastable
+    x = np.linspace(0, 1, len(payment))
+    weights = 1 - np.asarray(tapers, dtype=float)[..., None] * x
+    weights = weights / weights.mean(axis=-1, keepdims=True)
+    return (1 - np.asarray(green_shares, dtype=float))[..., None] * payment.mean() * weights
+
+def water_fill(payment, budget):
+    # dividends max(p - level, 0) adding up to the budget: the least largest loss;
+    # the level is below zero (everyone gains the same) when the budget exceeds the payments
+    if budget <= 0:
+        return np.zeros(len(payment))
+    level = brentq(lambda level: np.maximum(payment - level, 0).sum() - budget,
+                   payment.min() - budget / len(payment), payment.max())
+    return np.maximum(payment - level, 0)
+
+def targeted_dividends(payment, green_share):
+    """Dividends per quantile with the least bottom loss, then the least largest loss.
+
+    The payments of the bottom quantiles are returned first, the rest of the
+    budget levels the losses of the others. With too small a budget for that,
+    it levels the losses of the bottom quantiles only.
+    """
+    k = bottom_count(len(payment))
+    budget = (1 - green_share) * payment.sum()
+    if budget >= payment.sum():
+        return water_fill(payment, budget)
+    if budget <= payment[:k].sum():
+        return np.concatenate([water_fill(payment[:k], budget), np.zeros(len(payment) - k)])
+    return np.concatenate([payment[:k], water_fill(payment[k:], budget - payment[:k].sum())])
+
+def best_tapers(payment, green_shares, tapers=TAPERS):
+    # per green share: the taper on the grid with the least objective, refined between its neighbours
+    dividends = tapered_dividends(payment, tapers[None, :], np.asarray(green_shares)[:, None])
+    objectives = evaluate(payment, dividends.reshape(-1, len(payment)))
+    score = (objectives['bottom_loss'] + TIE_BREAK * objectives['max_loss']).reshape(len(green_shares), -1)
+    best = []
+    step = tapers[1] - tapers[0]
+    for green_share, i in zip(green_shares, score.argmin(axis=1)):
+        def objective(taper):
+            result = evaluate(payment, tapered_dividends(payment, [taper], [green_share]))
+            return result['bottom_loss'][0] + TIE_BREAK * result['max_loss'][0]
+        refined = minimize_scalar(objective, bounds=(max(tapers[i] - step, tapers[0]),
+                                                     min(tapers[i] + step, tapers[-1])),
+                                  method='bounded', options=dict(xatol=1e-4))
+        best.append(refined.x if refined.fun <= score[len(best), i] else tapers[i])
+    return np.array(best)
+
+def pareto_mask(bottom_loss, green_share):
+    # not dominated: no other point invests at least as much with at most the same loss, one strictly
+    order = np.lexsort((bottom_loss, -green_share))
+    mask = np.zeros(len(order), dtype=bool)
+    best_loss = np.inf
+    for i in order:
+        if bottom_loss[i] < best_loss - 1e-9:
+            mask[i] = True
+            best_loss = bottom_loss[i]
+    return mask
+
+def recycling_fronts(payment, green_shares=GREEN_SHARES):
+    """{scheme: dict of arrays, one value per point}, for the payment per quantile.
+
+    Arrays: 'green_share', 'param' (taper, else NaN), 'dividends' (n_points,
+    n_quantiles), the objectives of evaluate() and 'pareto', True for the points
+    on the Pareto front over all schemes (least bottom loss, largest investment).
+    """
+    payment = np.asarray(payment, dtype=float)
+    green_shares = np.asarray(green_shares, dtype=float)
+    tapers = best_tapers(payment, green_shares)
+    candidates = {'flat': (np.zeros(1), np.full(1, np.nan), flat_dividends(payment, [0.])),
+                  'green': (green_shares, np.full(len(green_shares), np.nan),
+                            flat_dividends(payment, green_shares)),
+                  'tapered': (green_shares, tapers, tapered_dividends(payment, tapers, green_shares)),
+                  'targeted': (green_shares, np.full(len(green_shares), np.nan),
+                               np.array([targeted_dividends(payment, g) for g in green_shares]))}
+    fronts = {}
+    for scheme, (shares, params, dividends) in candidates.items():
+        fronts[scheme] = dict(evaluate(payment, dividends), green_share=shares, param=params,
+                              dividends=dividends)
+    all_loss = np.concatenate([front['bottom_loss'] for front in fronts.values()])
+    all_green = np.concatenate([front['green_share'] for front in fronts.values()])
+    mask = pareto_mask(all_loss, all_green)
+    start = 0
+    for front in fronts.values():
+        front['pareto'] = mask[start:start + len(front['green_share'])]
+        start += len(front['green_share'])
+    return fronts
+
+def budget_residual(payment, dividends, green_share):
+    # dividends plus investment minus the payments; zero for budget-neutral schemes
+    return dividends.sum(axis=-1) + np.asarray(green_share) * payment.sum() - payment.sum()
+
+
+scheme_names = {'flat': 'Flat dividend', 'green': 'Flat dividend, green investment',
+                'tapered': 'Income-tapered dividend', 'targeted': 'Targeted per quantile'}
+scheme_colors = {'flat': 'rgb(69, 161, 69)', 'green': 'rgb(128, 179, 128)',
+                 'tapered': 'rgb(122, 138, 184)', 'targeted': 'rgb(184, 122, 138)'}
+
+def make_recycling_figure(fronts, unit, country=None, quantiles='deciles', width=800, height=600):
+    # bottom loss against the invested share per scheme, the Pareto front marked
+    import plotly.graph_objects as go
+    from plots import paper_bgcolor, title_country_dict
+    traces = []
+    for scheme, front in fronts.items():
+        hover = [f"taper {param:.2f}" if not np.isnan(param) else '' for param in front['param']]
+        traces.append(dict(type='scatter', x=100 * front['green_share'], y=front['bottom_loss'],
+                           name=scheme_names[scheme], mode='lines+markers' if len(hover) > 1 else 'markers',
+                           marker=dict(color=scheme_colors[scheme], size=6),
+                           line=dict(color=scheme_colors[scheme], width=2), text=hover))
+    pareto = [(100 * front['green_share'][i], front['bottom_loss'][i])
+              for front in fronts.values() for i in np.flatnonzero(front['pareto'])]
+    pareto.sort()
+    traces.append(dict(type='scatter', x=[x for x, _ in pareto], y=[y for _, y in pareto],
+                       name='Pareto front', mode='markers',
+                       marker=dict(color='rgba(0, 0, 0, 0)', size=12, line=dict(color='black', width=1.5))))
+    title = 'Budget-neutral revenue recycling'
+    if country is not None:
+        title += f', {title_country_dict.get(country, country)}'
+    fig = go.Figure(layout=dict(
+        title=dict(text=title, xanchor='center', x=0.5),
+        xaxis=dict(title='Revenue invested (%)', range=[-2, 102]),
+        yaxis=dict(title=f'Average loss, bottom {BOTTOM_SHARE:.0%} of households ({unit}/year)'),
+        legend=dict(orientation='h', x=0.5, xanchor='center', y=-0.15, yanchor='top'),
+        paper_bgcolor=paper_bgcolor,
+        plot_bgcolor=paper_bgcolor,
+        width=width,
+        height=height,
+    ))
+    fig.add_traces(traces)
+    return fig
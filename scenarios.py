@@ -0,0 +1,48 @@
+import numpy as np
+
+# Payment, revenue and net gain per quantile for a grid of carbon prices.
+# All (price, quantile) pairs are computed in one broadcast operation from the
+# effective emissions per quantile (calc_tCO2).
+
+
+def emissions(df, meta_data):
+    # tCO2 per quantile, derived from the payment at the metadata price if not in the data
+    if 'calc_tCO2' in df.columns:
+        return df['calc_tCO2'].to_numpy(dtype=float)
+    return df['carbon payment'].to_numpy(dtype=float) / float(meta_data['price'])
+
+def sweep(df, meta_data, prices, dividend_share=1.0, elasticities=0.):
+    """Scenario results as a dict of (n_prices, n_quantiles) arrays.
+
+    dividend_share is the share of the revenue returned as a flat dividend,
+    either a scalar or one value per price. elasticities (scalar or one value
+    per quantile) give the relative change in emissions per relative change in
+    carbon price, linearized around the metadata price.
+    """
+    base_price = float(meta_data['price'])
+    prices = np.asarray(prices, dtype=float).reshape(-1, 1)
+    shares = np.asarray(dividend_share, dtype=float)
+    if shares.ndim:
+        shares = shares.reshape(-1, 1)
+    tco2 = emissions(df, meta_data)[None, :]
+    response = 1 + np.asarray(elasticities, dtype=float) * (prices - base_price) / base_price
+    tco2 = tco2 * np.maximum(response, 0)
+    payment = prices * tco2
+    # quantiles hold equal numbers of households, so the flat dividend is a share of the mean payment
+    revenue = np.broadcast_to(shares * payment.mean(axis=1, keepdims=True), payment.shape)
+    return {'carbon payment': payment,
+            'carbon revenue': revenue,
+            'net gain': revenue - payment,
+            'calc_tCO2': tco2}
+
+def price_trajectory(start_price, increase, n_years):
+    # carbon price per year, rising by a fixed amount per year
+    return start_price + increase * np.arange(n_years, dtype=float)
+
+def scenario_frame(df, meta_data, price, dividend_share=1.0, elasticities=0.):
+    # the data at a single price, in the schema of datasets/<country>.csv
+    results = sweep(df, meta_data, [price], dividend_share, elasticities)
+    scenario_df = df.copy()
+    for col, values in results.items():
+        scenario_df[col] = values[0]
+    return scenario_df
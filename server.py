@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import gzip
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+import tornado.ioloop
+import tornado.web
+from currency import target_units
+from datastore import registry
+import prefetch
+from figures import (countries, quantile_options, orientation_options, plot_type_options,
+                     figure_json, MAX_PRICE_FACTOR, slider_price)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Serves the app's figures as plotly JSON for embedding, without a Streamlit session:
+#   python server.py --port 8050
+#   GET /figure?country=uk&quantiles=deciles&orientation=horizontal&plot_type=bars&width=800&height=600
+# Responses carry a strong ETag (304 on a matching If-None-Match) and are
+# gzip or brotli compressed. Encoded bodies are cached per figure; their ETags
+# are the hash of the JSON plus a suffix per content coding, e.g. "<sha1>-gzip".
+# Prices are rounded to the app slider's step.
+
+MAX_BODIES = 512
+
+
+class BodyCache:
+    # (country, dataset version, options) -> (sha1 of the JSON, {content encoding: body})
+
+    def __init__(self, max_entries=MAX_BODIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, fig_json):
+        body = fig_json.encode('utf-8')
+        entry = (hashlib.sha1(body).hexdigest(), {'identity': body})
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def etag(entry, encoding):
+        # strong validators differ per content coding
+        return f'"{entry[0]}"' if encoding == 'identity' else f'"{entry[0]}-{encoding}"'
+
+    @staticmethod
+    def encoded(entry, encoding):
+        bodies = entry[1]
+        if encoding not in bodies:
+            # benign race: two requests may compress the same body once each
+            if encoding == 'br':
+                bodies['br'] = brotli.compress(bodies['identity'])
+            else:
+                bodies['gzip'] = gzip.compress(bodies['identity'], compresslevel=6)
+        return bodies[encoding]
+
+
+body_cache = BodyCache()
+
+
+def figure_options(get_argument, country):
+    # query arguments -> figure options; raises ValueError on invalid values
+    def flag(name):
+        return get_argument(name, 'false').lower() in ('1', 'true', 'yes')
+
+    orientation = get_argument('orientation', 'horizontal')
+    options = dict(quantiles=get_argument('quantiles', 'deciles'),
+                   orientation=orientation_options.get(orientation, orientation),
+                   plot_type=get_argument('plot_type', 'bars and line'),
+                   width=int(get_argument('width', '800')),
+                   height=int(get_argument('height', '600')),
+                   reverse=flag('reverse'),
+                   payment_negative=flag('payment_negative'),
+                   uncertainty=flag('uncertainty'))
+    price = get_argument('price', None)
+    options['price'] = float(price) if price is not None else None
+    if options['price'] is not None:
+        base_price = float(registry.load_metadata(country)['price'])
+        max_price = MAX_PRICE_FACTOR * base_price
+        if not (math.isfinite(options['price']) and 0 <= options['price'] <= max_price):
+            raise ValueError(f"price must be between 0 and {max_price:g}")
+        # every new price is a new figure: only the slider's prices
+        options['price'] = slider_price(options['price'], base_price)
+    options['currency'] = get_argument('currency', None)
+    if options['currency'] is not None and options['currency'] not in target_units:
+        raise ValueError(f"currency must be one of {target_units}")
+    if options['quantiles'] not in quantile_options:
+        raise ValueError(f"quantiles must be one of {quantile_options}")
+    if options['orientation'] not in orientation_options.values():
+        raise ValueError(f"orientation must be one of {list(orientation_options)}")
+    if options['plot_type'] not in plot_type_options:
+        raise ValueError(f"plot_type must be one of {plot_type_options}")
+    if not (100 <= options['width'] <= 4000 and 100 <= options['height'] <= 4000):
+        raise ValueError("width and height must be between 100 and 4000")
+    return options
+
+def accepted_encoding(accept_encoding):
+    accepted = set()
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+
+class FigureHandler(tornado.web.RequestHandler):
+
+    def compute_etag(self):
+        # the ETag is set from the body cache, not computed from the written body
+        return None
+
+    async def get(self):
+        country = self.get_argument('country')
+        if country not in countries():
+            raise tornado.web.HTTPError(404, f"unknown country {country}")
+        try:
+            options = figure_options(self.get_argument, country)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+
+        key = (country, registry.version(country), tuple(sorted(options.items())))
+        entry = body_cache.get(key)
+        if entry is None:
+            # figure building is CPU bound, keep it off the event loop
+            loop = asyncio.get_event_loop()
+            prefetch.prefetcher.served(dict(options, country=country))
+            fig_json = await loop.run_in_executor(None, lambda: figure_json(country, **options))
+            entry = body_cache.put(key, fig_json)
+            prefetch.prefetcher.prefetch_next(dict(options, country=country), self.request.remote_ip)
+
+        encoding = accepted_encoding(self.request.headers.get('Accept-Encoding', ''))
+        self.set_header('ETag', BodyCache.etag(entry, encoding))
+        self.set_header('Cache-Control', 'public, max-age=60')
+        self.set_header('Vary', 'Accept-Encoding')
+        if_none_match = self.request.headers.get('If-None-Match', '')
+        # If-None-Match uses the weak comparison, so W/ prefixes are ignored; a tag
+        # of any content coding of the same JSON matches
+        tags = [tag.strip().replace('W/', '', 1).strip('"') for tag in if_none_match.split(',')]
+        if if_none_match.strip() == '*' or entry[0] in [tag.split('-', 1)[0] for tag in tags]:
+            self.set_status(304)
+            return
+
+        if encoding != 'identity':
+            self.set_header('Content-Encoding', encoding)
+        self.set_header('Content-Type', 'application/json')
+        self.write(BodyCache.encoded(entry, encoding))
+
+
+class HealthHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.write({'status': 'ok', 'countries': countries()})
+
+
+def make_app():
+    return tornado.web.Application([(r'/figure', FigureHandler),
+                                    (r'/health', HealthHandler)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve figure JSON for embedding')
+    parser.add_argument('--port', type=int, default=8050)
+    args = parser.parse_args()
+    make_app().listen(args.port)
+    prefetch.start()
+    print(f"Serving figures on http://localhost:{args.port}/figure")
+    tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Monte-Carlo percentile bands for the net gain per quantile. The net gain is
+# perturbed with normal errors on the payment per quantile and on the flat
+# revenue, e.g. the digitization errors estimated in process_rawdata.py.
+# Bands are sampled once per number of quantiles at unit std, on one process
+# pool per process, and scaled to the std of each price and currency.
+
+N_SAMPLES = 1_000_000
+BATCH_SIZE = 100_000
+PERCENTILES = (5, 50, 95)
+# least recently used bands are dropped beyond this many; bands are cached at
+# unit std, so there is about one per number of quantiles
+BAND_CACHE_ENTRIES = 256
+
+_cache_lock = threading.Lock()
+_band_cache = OrderedDict()
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def _sample_batch(net_gain, payment_std, revenue_std, n_samples, seed):
+    rng = np.random.default_rng(seed)
+    payment_errors = payment_std * rng.standard_normal((n_samples, len(net_gain)))
+    # the revenue is a single flat value, so one draw per sample
+    revenue_errors = revenue_std * rng.standard_normal((n_samples, 1))
+    return (net_gain + revenue_errors - payment_errors).astype(np.float32)
+
+def process_pool():
+    # one pool per process, created on first use and shared by every later sampling
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor()
+        return _pool
+
+def sample_net_gain(net_gain, payment_std, revenue_std, n_samples=N_SAMPLES,
+                    seed=0, batch_size=BATCH_SIZE, n_workers=None):
+    """(n_samples, n_quantiles) net gain samples, reproducible for a given seed.
+
+    Samples are drawn in batches with independent child seeds, spread over the
+    shared process pool (a pool of its own for n_workers > 1) unless n_workers
+    is 1. The result does not depend on n_workers.
+    """
+    net_gain = np.asarray(net_gain, dtype=float)
+    sizes = [min(batch_size, n_samples - start) for start in range(0, n_samples, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(net_gain, payment_std, revenue_std, size, batch_seed)
+            for size, batch_seed in zip(sizes, seeds)]
+    if n_workers == 1 or len(args) == 1:
+        batches = [_sample_batch(*arg) for arg in args]
+    elif n_workers is None:
+        batches = list(process_pool().map(_sample_batch, *zip(*args)))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            batches = list(pool.map(_sample_batch, *zip(*args)))
+    return np.concatenate(batches)
+
+def net_gain_bands(df, payment_std, revenue_std=None, percentiles=PERCENTILES, **kwargs):
+    # (len(percentiles), n_quantiles) array of net gain percentiles around the net gain in df
+    revenue_std = payment_std if revenue_std is None else revenue_std
+    samples = sample_net_gain(df['net gain'], payment_std, revenue_std, **kwargs)
+    return np.percentile(samples, percentiles, axis=0)
+
+def unit_bands(n_quantiles, payment_std, revenue_std, percentiles=PERCENTILES, **kwargs):
+    # percentiles of the error alone (zero net gain) at the given stds, cached
+    key = (n_quantiles, payment_std, revenue_std, percentiles, tuple(sorted(kwargs.items())))
+    with _cache_lock:
+        bands = _band_cache.get(key)
+        if bands is not None:
+            _band_cache.move_to_end(key)
+            return bands
+    bands = np.percentile(sample_net_gain(np.zeros(n_quantiles), payment_std, revenue_std, **kwargs),
+                          percentiles, axis=0)
+    bands.setflags(write=False)
+    with _cache_lock:
+        _band_cache[key] = bands
+        while len(_band_cache) > BAND_CACHE_ENTRIES:
+            _band_cache.popitem(last=False)
+    return bands
+
+def cached_net_gain_bands(df, payment_std, revenue_std=None, percentiles=PERCENTILES, **kwargs):
+    """net_gain_bands from cached bands at unit std.
+
+    For a fixed seed the samples are net gain + std * (the same standard
+    errors), so the percentiles are net gain + std * their percentiles at
+    unit std. Only the ratio of the two stds needs sampling; a new price or
+    currency scales the cached bands.
+    """
+    revenue_std = payment_std if revenue_std is None else revenue_std
+    net_gain = np.asarray(df['net gain'], dtype=float)
+    scale = max(payment_std, revenue_std)
+    if scale == 0:
+        return np.tile(net_gain, (len(percentiles), 1))
+    bands = unit_bands(len(net_gain), payment_std / scale, revenue_std / scale, percentiles, **kwargs)
+    return net_gain + scale * bands